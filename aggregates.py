@@ -0,0 +1,97 @@
+"""
+课程汇总字段的增量维护 - course.rating_avg / rating_count / enrollment_count
+
+评分通过 course_stats 汇总表 (精确的评分总和与条数) 由触发器增量更新, 报名数由 enrollment 触发器加减;
+reconcile() 用一次批量聚合核对并修复漂移
+"""
+
+
+def _review_delta(sign, row):
+    # row 为 'new' 或 'old'; 只有已审核通过的评价计入评分
+    return (f"{sign}1", f"{sign}({row}.status = 'approved')", f"{sign}(CASE WHEN {row}.status = 'approved' THEN {row}.rating ELSE 0 END)")
+
+
+def _add_review(row):
+    review_count, rating_count, rating_sum = _review_delta('', row)
+    return f'''INSERT INTO course_stats (course_id, review_count, rating_count, rating_sum) VALUES ({row}.course_id, {review_count}, {rating_count}, {rating_sum})
+        ON CONFLICT (course_id) DO UPDATE SET review_count = review_count + excluded.review_count, rating_count = rating_count + excluded.rating_count, rating_sum = rating_sum + excluded.rating_sum;'''
+
+
+def _remove_review(row):
+    review_count, rating_count, rating_sum = _review_delta('-', row)
+    return f'''UPDATE course_stats SET review_count = review_count + {review_count}, rating_count = rating_count + {rating_count}, rating_sum = rating_sum + {rating_sum} WHERE course_id = {row}.course_id;'''
+
+
+def _sync_course(row):
+    return f'''UPDATE course SET (rating_count, rating_avg) = (SELECT rating_count, CASE WHEN rating_count > 0 THEN ROUND(1.0 * rating_sum / rating_count, 2) ELSE 0 END
+        FROM course_stats WHERE course_id = {row}.course_id) WHERE course_id = {row}.course_id;'''
+
+
+SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS course_stats (course_id INTEGER PRIMARY KEY, review_count INTEGER NOT NULL DEFAULT 0, rating_count INTEGER NOT NULL DEFAULT 0, rating_sum INTEGER NOT NULL DEFAULT 0);
+    CREATE TRIGGER IF NOT EXISTS review_stats_ai AFTER INSERT ON review BEGIN
+        {_add_review('new')}
+        {_sync_course('new')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS review_stats_ad AFTER DELETE ON review BEGIN
+        {_remove_review('old')}
+        {_sync_course('old')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS review_stats_au AFTER UPDATE OF course_id, rating, status ON review BEGIN
+        {_remove_review('old')}
+        {_add_review('new')}
+        {_sync_course('old')}
+        {_sync_course('new')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS enrollment_count_ai AFTER INSERT ON enrollment BEGIN
+        UPDATE course SET enrollment_count = enrollment_count + 1 WHERE course_id = new.course_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS enrollment_count_ad AFTER DELETE ON enrollment BEGIN
+        UPDATE course SET enrollment_count = enrollment_count - 1 WHERE course_id = old.course_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS enrollment_count_au AFTER UPDATE OF course_id ON enrollment WHEN old.course_id != new.course_id BEGIN
+        UPDATE course SET enrollment_count = enrollment_count - 1 WHERE course_id = old.course_id;
+        UPDATE course SET enrollment_count = enrollment_count + 1 WHERE course_id = new.course_id;
+    END;
+'''
+
+_ACTUAL = '''WITH r AS (SELECT course_id, COUNT(*) AS review_count, SUM(status = 'approved') AS rating_count,
+        SUM(CASE WHEN status = 'approved' THEN rating ELSE 0 END) AS rating_sum FROM review GROUP BY course_id),
+    e AS (SELECT course_id, COUNT(*) AS enrollment_count FROM enrollment GROUP BY course_id)'''
+
+
+def rebuild_stats(conn):
+    """由 review 表重建 course_stats (不修改 course 上的汇总列)"""
+    conn.execute('DELETE FROM course_stats')
+    conn.execute(f'''INSERT INTO course_stats (course_id, review_count, rating_count, rating_sum)
+        {_ACTUAL} SELECT course_id, review_count, rating_count, rating_sum FROM r''')
+
+
+def repair_drift(conn, repair=True):
+    """在调用方的事务中核对 (并修复) 所有课程的汇总值, 返回存在漂移的课程数"""
+    drifted = conn.execute(f'''{_ACTUAL},
+        actual AS (SELECT c.course_id, COALESCE(e.enrollment_count, 0) AS enrollment_count, COALESCE(r.review_count, 0) AS review_count,
+            COALESCE(r.rating_count, 0) AS rating_count, COALESCE(r.rating_sum, 0) AS rating_sum,
+            CASE WHEN r.rating_count > 0 THEN ROUND(1.0 * r.rating_sum / r.rating_count, 2) ELSE 0 END AS rating_avg
+            FROM course c LEFT JOIN r ON r.course_id = c.course_id LEFT JOIN e ON e.course_id = c.course_id)
+        SELECT a.* FROM actual a JOIN course c ON c.course_id = a.course_id LEFT JOIN course_stats s ON s.course_id = a.course_id
+        WHERE c.enrollment_count IS NOT a.enrollment_count OR c.rating_count IS NOT a.rating_count OR c.rating_avg IS NOT a.rating_avg
+            OR COALESCE(s.review_count, 0) != a.review_count OR COALESCE(s.rating_count, 0) != a.rating_count OR COALESCE(s.rating_sum, 0) != a.rating_sum''').fetchall()
+    if repair and drifted:
+        conn.executemany('UPDATE course SET enrollment_count = ?, rating_count = ?, rating_avg = ? WHERE course_id = ?',
+                         [(row['enrollment_count'], row['rating_count'], row['rating_avg'], row['course_id']) for row in drifted])
+        conn.executemany('INSERT OR REPLACE INTO course_stats (course_id, review_count, rating_count, rating_sum) VALUES (?, ?, ?, ?)',
+                         [(row['course_id'], row['review_count'], row['rating_count'], row['rating_sum']) for row in drifted])
+    return len(drifted)
+
+
+def reconcile(conn, repair=True):
+    """核对所有课程的汇总值; 返回存在漂移的课程数, repair 为真时一并修复"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        drifted = repair_drift(conn, repair)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return drifted
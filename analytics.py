@@ -0,0 +1,140 @@
+"""
+SQL 演示页的分析快照 - 在后台按计划或数据变化时重新计算, 页面直接读取最新快照
+
+每条查询的耗时与行数随快照一起记录, 供页面展示与导出
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import db
+
+# 最短刷新间隔 (数据有变化时) 与最长间隔 (无论是否变化) , 单位秒
+MIN_REFRESH_INTERVAL = 60
+MAX_REFRESH_INTERVAL = 900
+CHECK_INTERVAL = 15
+TIMING_HISTORY = 50
+
+logger = logging.getLogger(__name__)
+
+# (key, 标题, 展示用 SQL, 实际执行的 SQL)
+DEMO_QUERIES = [
+    ('single_table', '单表查询 - 价格>100的已发布课程', "SELECT ... FROM course WHERE price > 100 AND status = 'published'",
+     'SELECT course_id, title, price, level, rating_avg, enrollment_count FROM course WHERE price > 100 AND status = "published" ORDER BY rating_avg DESC'),
+    ('inner_join', '内连接 - 课程与讲师、分类', "SELECT ... FROM course c INNER JOIN user u ... INNER JOIN category cat ...",
+     'SELECT c.title, c.price, u.username as instructor, cat.category_name FROM course c INNER JOIN user u ON c.instructor_id = u.user_id INNER JOIN category cat ON c.category_id = cat.category_id WHERE c.status = "published"'),
+    ('left_join', '左外连接 - 课程及评价数量', "SELECT ... FROM course c LEFT JOIN course_stats s ON c.course_id = s.course_id",
+     'SELECT c.title, c.price, COALESCE(s.review_count, 0) as review_count FROM course c LEFT JOIN course_stats s ON c.course_id = s.course_id WHERE c.status = "published"'),
+    ('self_join', '自连接 - 分类层级关系', "SELECT c.category_name, p.category_name FROM category c LEFT JOIN category p ON c.parent_id = p.category_id",
+     'SELECT c.category_name as category, COALESCE(p.category_name, "顶级分类") as parent FROM category c LEFT JOIN category p ON c.parent_id = p.category_id'),
+    ('aggregate', '聚合函数 - 讲师统计', "SELECT ... COUNT(), SUM(), AVG() ... GROUP BY ... ORDER BY ...",
+     'SELECT u.username, COUNT(c.course_id) as course_count, SUM(c.enrollment_count) as total_students, ROUND(AVG(c.rating_avg), 2) as avg_rating FROM user u JOIN course c ON u.user_id = c.instructor_id WHERE c.status = "published" GROUP BY u.user_id ORDER BY total_students DESC'),
+    ('date_functions', '日期函数 - 按日订单统计', "SELECT DATE(created_at), COUNT(*), SUM() ... GROUP BY DATE(created_at)",
+     'SELECT DATE(created_at) as order_date, COUNT(*) as order_count, SUM(final_amount) as daily_revenue FROM "order" WHERE payment_status = "paid" GROUP BY DATE(created_at) ORDER BY order_date DESC'),
+    ('subquery', '子查询 - 报名数超过平均值的课程', "SELECT ... WHERE enrollment_count > (SELECT AVG(...) ...)",
+     'SELECT title, price, enrollment_count FROM course WHERE enrollment_count > (SELECT AVG(enrollment_count) FROM course WHERE status = "published") AND status = "published"'),
+    ('correlated_subquery', '相关子查询 - 每个分类评分最高的课程', "SELECT ... WHERE rating_avg = (SELECT MAX(...) WHERE c2.category_id = c.category_id ...)",
+     'SELECT c.title, c.rating_avg, cat.category_name FROM course c JOIN category cat ON c.category_id = cat.category_id WHERE c.rating_avg = (SELECT MAX(c2.rating_avg) FROM course c2 WHERE c2.category_id = c.category_id AND c2.status = "published") AND c.status = "published"'),
+    ('union', 'UNION - 用户1的收藏和已购课程', "SELECT ... UNION SELECT ...",
+     'SELECT c.title, "已购买" as source FROM course c JOIN enrollment e ON c.course_id = e.course_id WHERE e.user_id = 1 UNION SELECT c.title, "已收藏" as source FROM course c JOIN favorite f ON c.course_id = f.course_id WHERE f.user_id = 1'),
+    ('multi_join', '多表连接 - 用户学习报告', "SELECT ... FROM user u JOIN enrollment e JOIN course c LEFT JOIN category cat JOIN user inst ...",
+     'SELECT u.username, c.title, e.progress_percent, cat.category_name, inst.username as instructor FROM user u JOIN enrollment e ON u.user_id = e.user_id JOIN course c ON e.course_id = c.course_id LEFT JOIN category cat ON c.category_id = cat.category_id JOIN user inst ON c.instructor_id = inst.user_id WHERE u.user_id = 1'),
+    ('division', '除法查询 - 学完讲师3所有课程的学员', "SELECT ... HAVING completed_courses = (SELECT COUNT(*) ...)",
+     'SELECT u.user_id, u.username, COUNT(DISTINCT e.course_id) as completed_courses FROM user u JOIN enrollment e ON u.user_id = e.user_id JOIN course c ON e.course_id = c.course_id WHERE c.instructor_id = 3 AND c.status = "published" AND e.status = "completed" GROUP BY u.user_id HAVING completed_courses = (SELECT COUNT(*) FROM course WHERE instructor_id = 3 AND status = "published")'),
+]
+
+
+class Snapshot:
+    def __init__(self, queries, generated_at, elapsed_ms):
+        self.queries = queries
+        self.generated_at = generated_at
+        self.elapsed_ms = elapsed_ms
+
+    @property
+    def age_seconds(self):
+        return (datetime.now() - self.generated_at).total_seconds()
+
+    def timings(self):
+        return [{'key': key, 'title': q['title'], 'elapsed_ms': q['elapsed_ms'], 'row_count': q['row_count']} for key, q in self.queries.items()]
+
+
+def build_snapshot(conn):
+    queries, started = {}, time.perf_counter()
+    for key, title, display_sql, sql in DEMO_QUERIES:
+        query_started = time.perf_counter()
+        cur = conn.execute(sql)
+        rows = [tuple(row) for row in cur]
+        queries[key] = {'title': title, 'sql': display_sql, 'columns': [d[0] for d in cur.description], 'result': rows,
+                        'elapsed_ms': round((time.perf_counter() - query_started) * 1000, 3), 'row_count': len(rows)}
+    return Snapshot(queries, datetime.now(), round((time.perf_counter() - started) * 1000, 3))
+
+
+class SnapshotEngine:
+    """持有最新快照; 后台线程通过 PRAGMA data_version 发现其他连接提交的写入后刷新"""
+
+    def __init__(self, database=None):
+        self.database = database
+        self.snapshot = None
+        self.history = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def latest(self):
+        if self.snapshot is None:
+            with self._lock:
+                if self.snapshot is None:
+                    conn = db.connect(self.database)
+                    try:
+                        self._store(build_snapshot(conn))
+                    finally:
+                        conn.close()
+        self._ensure_thread()
+        return self.snapshot
+
+    def refresh(self, conn):
+        snapshot = build_snapshot(conn)
+        with self._lock:
+            self._store(snapshot)
+        return snapshot
+
+    def _store(self, snapshot):
+        self.snapshot = snapshot
+        self.history.append({'generated_at': snapshot.generated_at.isoformat(), 'elapsed_ms': snapshot.elapsed_ms, 'queries': snapshot.timings()})
+        del self.history[:-TIMING_HISTORY]
+
+    def _ensure_thread(self):
+        # fork 之后或线程意外退出 (如打不开数据库) 时, 下一次读取快照会重新启动后台线程
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='analytics-snapshot', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            conn = db.connect(self.database)
+            version = conn.execute('PRAGMA data_version').fetchone()[0]
+        except Exception:
+            logger.exception('Analytics snapshot thread failed to start')
+            return
+        try:
+            while True:
+                time.sleep(CHECK_INTERVAL)
+                try:
+                    current = conn.execute('PRAGMA data_version').fetchone()[0]
+                    age = self.snapshot.age_seconds
+                    if (current != version and age >= MIN_REFRESH_INTERVAL) or age >= MAX_REFRESH_INTERVAL:
+                        version = current
+                        self.refresh(conn)
+                except Exception:
+                    logger.exception('Failed to refresh analytics snapshot')
+        finally:
+            conn.close()
+
+
+snapshots = SnapshotEngine()
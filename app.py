@@ -3,51 +3,56 @@
 """
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
 from functools import wraps
-import sqlite3
-import os
+import click
 from datetime import datetime
 import hashlib
+import json
 import secrets
+import aggregates
+import analytics
+import authz
+import cache
+import curriculum
+import db
+import enrollments
+import metrics
+import migrations
+import pagecache
+import pagination
+import progress
+import recommend
+import reports
+import search
+import taxonomy
+import versions
+from db import get_db
 
 app = Flask(__name__)
 app.secret_key = secrets.token_hex(16)
-DATABASE = os.path.join(os.path.dirname(__file__), 'learning_platform.db')
-
-def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+db.init_app(app)
+metrics.init_app(app)
 
 def init_db():
-    conn = get_db()
-    c = conn.cursor()
-    c.executescript('''
-        CREATE TABLE IF NOT EXISTS user (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, email TEXT NOT NULL UNIQUE, password_hash TEXT NOT NULL, phone TEXT, status TEXT DEFAULT 'active', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_login DATETIME);
-        CREATE TABLE IF NOT EXISTS user_profile (profile_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL UNIQUE, avatar_url TEXT, bio TEXT, gender TEXT, location TEXT, occupation TEXT, FOREIGN KEY (user_id) REFERENCES user(user_id));
-        CREATE TABLE IF NOT EXISTS role (role_id INTEGER PRIMARY KEY AUTOINCREMENT, role_name TEXT NOT NULL UNIQUE, description TEXT);
-        CREATE TABLE IF NOT EXISTS user_role (user_id INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (user_id, role_id));
-        CREATE TABLE IF NOT EXISTS category (category_id INTEGER PRIMARY KEY AUTOINCREMENT, category_name TEXT NOT NULL, parent_id INTEGER, description TEXT, sort_order INTEGER DEFAULT 0);
-        CREATE TABLE IF NOT EXISTS course (course_id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, subtitle TEXT, description TEXT, instructor_id INTEGER NOT NULL, category_id INTEGER, cover_image TEXT, price REAL DEFAULT 0.00, original_price REAL, level TEXT DEFAULT 'beginner', duration_hours REAL DEFAULT 0, status TEXT DEFAULT 'draft', is_featured INTEGER DEFAULT 0, enrollment_count INTEGER DEFAULT 0, rating_avg REAL DEFAULT 0.00, rating_count INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, published_at DATETIME);
-        CREATE TABLE IF NOT EXISTS chapter (chapter_id INTEGER PRIMARY KEY AUTOINCREMENT, course_id INTEGER NOT NULL, title TEXT NOT NULL, description TEXT, sort_order INTEGER DEFAULT 0, is_free INTEGER DEFAULT 0);
-        CREATE TABLE IF NOT EXISTS lesson (lesson_id INTEGER PRIMARY KEY AUTOINCREMENT, chapter_id INTEGER NOT NULL, title TEXT NOT NULL, content_type TEXT DEFAULT 'video', video_url TEXT, video_duration INTEGER DEFAULT 0, sort_order INTEGER DEFAULT 0, is_free INTEGER DEFAULT 0);
-        CREATE TABLE IF NOT EXISTS "order" (order_id INTEGER PRIMARY KEY AUTOINCREMENT, order_no TEXT NOT NULL UNIQUE, user_id INTEGER NOT NULL, total_amount REAL NOT NULL, discount_amount REAL DEFAULT 0.00, final_amount REAL NOT NULL, payment_method TEXT DEFAULT 'alipay', payment_status TEXT DEFAULT 'pending', paid_at DATETIME, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
-        CREATE TABLE IF NOT EXISTS order_item (item_id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER NOT NULL, course_id INTEGER NOT NULL, price REAL NOT NULL);
-        CREATE TABLE IF NOT EXISTS enrollment (enrollment_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, order_id INTEGER, progress_percent REAL DEFAULT 0.00, completed_lessons INTEGER DEFAULT 0, total_lessons INTEGER DEFAULT 0, status TEXT DEFAULT 'active', enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_accessed_at DATETIME, UNIQUE (user_id, course_id));
-        CREATE TABLE IF NOT EXISTS learning_progress (progress_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, lesson_id INTEGER NOT NULL, watched_duration INTEGER DEFAULT 0, progress_percent REAL DEFAULT 0.00, is_completed INTEGER DEFAULT 0, UNIQUE (user_id, lesson_id));
-        CREATE TABLE IF NOT EXISTS review (review_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, rating INTEGER NOT NULL, content TEXT, helpful_count INTEGER DEFAULT 0, status TEXT DEFAULT 'approved', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
-        CREATE TABLE IF NOT EXISTS favorite (favorite_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
-        CREATE TABLE IF NOT EXISTS cart (cart_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
-    ''')
-    conn.commit()
-    c.execute("SELECT COUNT(*) FROM user")
-    if c.fetchone()[0] == 0:
+    """把数据库结构升级到最新版本 (见 migrations.py); 示例数据改由 flask seed 显式导入"""
+    migrations.migrate(db.DATABASE)
+
+def seed_sample_data():
+    """库中还没有用户时导入示例数据 (测试账号、课程、订单等), 返回是否导入"""
+    init_db()
+    conn = db.connect()
+    try:
+        if conn.execute('SELECT 1 FROM user LIMIT 1').fetchone():
+            return False
         insert_sample_data(conn)
-    conn.close()
+        # 示例课程里写死的报名数/评分与实际插入的选课、评价不符, 按实际数据修正后触发器的增量才正确
+        aggregates.reconcile(conn)
+        return True
+    finally:
+        conn.close()
 
 def insert_sample_data(conn):
     c = conn.cursor()
     pw = hashlib.sha256('password123'.encode()).hexdigest()
-    c.executemany("INSERT INTO role (role_name, description) VALUES (?, ?)", [('student', 'Student'), ('instructor', 'Instructor'), ('admin', 'Administrator')])
     c.executemany("INSERT INTO user (username, email, password_hash, phone, status) VALUES (?, ?, ?, ?, ?)", [
         ('John', 'john@example.com', pw, '1234567001', 'active'),
         ('Mike', 'mike@example.com', pw, '1234567002', 'active'),
@@ -108,6 +113,21 @@ def insert_sample_data(conn):
     c.executemany("INSERT INTO favorite (user_id, course_id) VALUES (?, ?)", [(1, 3), (1, 5), (2, 1), (2, 5)])
     conn.commit()
 
+CATEGORY_CACHE_TTL = 300
+# 后台课程管理每页条数
+ADMIN_PAGE_SIZE = 20
+
+def catalog_query(key, sql, params=(), ttl=None):
+    return cache.catalog.get_or_load(key, lambda: [dict(row) for row in get_db().execute(sql, params)], ttl)
+
+def all_categories():
+    return catalog_query('categories:all', '''SELECT cat.*, COALESCE(s.course_count, 0) AS course_count FROM category cat
+        LEFT JOIN category_stats s ON s.category_id = cat.category_id ORDER BY cat.parent_id, cat.sort_order''', ttl=CATEGORY_CACHE_TTL)
+
+def invalidate_catalog():
+    # 首页与课程列表按 versions.py 的目录版本号缓存, 这里只需失效分类课程数
+    cache.catalog.invalidate('categories:all')
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -117,22 +137,35 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def roles_required(*roles):
+    """登录且拥有其中任一角色; 角色取自 authz 的缓存, 而不是登录时写入 session 的快照"""
+    def decorator(f):
+        @wraps(f)
+        @login_required
+        def decorated_function(*args, **kwargs):
+            if not authz.has_role(*roles):
+                flash('Access denied', 'error')
+                return redirect(url_for('index'))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@app.context_processor
+def inject_roles():
+    principal = authz.current()
+    return {'user_roles': principal.roles if principal else frozenset()}
+
 @app.route('/')
 def index():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('''SELECT c.*, u.username as instructor_name, cat.category_name FROM course c
-        LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id
-        WHERE c.status = 'published' AND c.is_featured = 1 ORDER BY c.enrollment_count DESC LIMIT 6''')
-    featured_courses = c.fetchall()
-    c.execute('''SELECT c.*, u.username as instructor_name, cat.category_name FROM course c
-        LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id
-        WHERE c.status = 'published' ORDER BY c.created_at DESC LIMIT 12''')
-    latest_courses = c.fetchall()
-    c.execute('SELECT * FROM category WHERE parent_id IS NULL ORDER BY sort_order')
-    categories = c.fetchall()
-    conn.close()
-    return render_template('index.html', featured_courses=featured_courses, latest_courses=latest_courses, categories=categories)
+    version = versions.catalog(get_db())
+    def render():
+        featured_courses = pagecache.fragment('home:featured', version.tag, 'partials/featured_courses.html', lambda: {'featured_courses': get_db().execute('''
+            SELECT c.*, u.username as instructor_name, cat.category_name FROM course c
+            LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id
+            WHERE c.status = 'published' AND c.is_featured = 1 ORDER BY c.enrollment_count DESC LIMIT 6''').fetchall()})
+        categories = catalog_query('categories:top', 'SELECT * FROM category WHERE parent_id IS NULL ORDER BY sort_order', ttl=CATEGORY_CACHE_TTL)
+        return render_template('index.html', featured_courses=featured_courses, categories=categories)
+    return pagecache.conditional(pagecache.etag('index', version.tag), version.last_modified, render)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -150,20 +183,17 @@ def register():
         if len(password) < 6:
             flash('Password must be at least 6 characters', 'error')
             return render_template('register.html')
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('SELECT user_id FROM user WHERE username = ? OR email = ?', (username, email))
-        if c.fetchone():
+        def create_user(conn, username, email, password_hash):
+            if conn.execute('SELECT user_id FROM user WHERE username = ? OR email = ?', (username, email)).fetchone():
+                return None
+            user_id = conn.execute('INSERT INTO user (username, email, password_hash) VALUES (?, ?, ?)', (username, email, password_hash)).lastrowid
+            conn.execute('INSERT INTO user_role (user_id, role_id) VALUES (?, 1)', (user_id,))
+            conn.execute('INSERT INTO user_profile (user_id) VALUES (?)', (user_id,))
+            return user_id
+        password_hash = hashlib.sha256(password.encode()).hexdigest()
+        if db.writer.call(create_user, username, email, password_hash) is None:
             flash('Username or email already exists', 'error')
-            conn.close()
             return render_template('register.html')
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        c.execute('INSERT INTO user (username, email, password_hash) VALUES (?, ?, ?)', (username, email, password_hash))
-        user_id = c.lastrowid
-        c.execute('INSERT INTO user_role (user_id, role_id) VALUES (?, 1)', (user_id,))
-        c.execute('INSERT INTO user_profile (user_id) VALUES (?)', (user_id,))
-        conn.commit()
-        conn.close()
         flash('Registration successful, please login', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -184,20 +214,17 @@ def login():
         if user:
             if user['status'] != 'active':
                 flash('Account has been disabled', 'error')
-                conn.close()
                 return render_template('login.html')
-            c.execute('UPDATE user SET last_login = ? WHERE user_id = ?', (datetime.now(), user['user_id']))
-            conn.commit()
+            db.writer.execute('UPDATE user SET last_login = ? WHERE user_id = ?', (datetime.now(), user['user_id']))
             session['user_id'] = user['user_id']
             session['username'] = user['username']
             session['email'] = user['email']
-            c.execute('SELECT r.role_name FROM role r JOIN user_role ur ON r.role_id = ur.role_id WHERE ur.user_id = ?', (user['user_id'],))
-            session['roles'] = [row['role_name'] for row in c.fetchall()]
-            conn.close()
+            # 角色在每次检查时从 authz 的缓存读取, 登录时只确保从库里重新加载
+            session.pop('roles', None)
+            authz.principals.invalidate(user['user_id'])
             flash(f'Welcome back, {user["username"]}!', 'success')
             return redirect(url_for('index'))
         flash('Invalid email or password', 'error')
-        conn.close()
     return render_template('login.html')
 
 @app.route('/logout')
@@ -209,59 +236,77 @@ def logout():
 @app.route('/courses')
 def courses():
     conn = get_db()
-    c = conn.cursor()
     category_id = request.args.get('category', type=int)
     level = request.args.get('level', '')
-    sort = request.args.get('sort', 'newest')
     keyword = request.args.get('keyword', '').strip()
-    query = '''SELECT c.*, u.username as instructor_name, cat.category_name FROM course c
-        LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id WHERE c.status = 'published' '''
+    match = search.match_expression(keyword)
+    # 只有标点等无法检索的关键词不产生筛选条件, 清空后标题与结果 (全部课程) 一致
+    if not match:
+        keyword = ''
+    sort = request.args.get('sort', 'relevance' if match else 'newest')
+    if sort not in ('newest', 'popular', 'rating', 'price_low', 'price_high') and not (sort == 'relevance' and match):
+        sort = 'newest'
+    cursor = request.args.get('cursor')
+    per_page = pagination.page_size(request.args.get('per_page', type=int))
+    version = versions.catalog(conn)
+    key = json.dumps([category_id, level, keyword, sort, cursor, per_page])
+    def load_page():
+        return {'courses': list_courses(conn, category_id, level, match, sort, cursor, per_page),
+                'current_category': category_id, 'current_level': level, 'current_sort': sort, 'keyword': keyword,
+                # 翻页与排序链接带上非默认的每页条数; 为 None 时 url_for 不生成该参数
+                'per_page': None if per_page == pagination.DEFAULT_PAGE_SIZE else per_page}
+    def render():
+        course_list = pagecache.fragment(f'courses:{key}', version.tag, 'partials/course_list.html', load_page)
+        return render_template('courses.html', course_list=course_list, categories=all_categories(), current_category=category_id, current_level=level, current_sort=sort, keyword=keyword)
+    return pagecache.conditional(pagecache.etag('courses', version.tag, key), version.last_modified, render)
+
+def list_courses(conn, category_id, level, match, sort, cursor, per_page):
+    source = 'course_fts JOIN course c ON c.course_id = course_fts.rowid' if match else 'course c'
+    query = f'''FROM {source} LEFT JOIN user u ON c.instructor_id = u.user_id
+        LEFT JOIN category cat ON c.category_id = cat.category_id WHERE c.status = 'published' '''
     params = []
     if category_id:
-        query += ' AND (c.category_id = ? OR cat.parent_id = ?)'
-        params.extend([category_id, category_id])
+        query += f' AND c.category_id IN ({taxonomy.SUBTREE})'
+        params.append(category_id)
     if level:
         query += ' AND c.level = ?'
         params.append(level)
-    if keyword:
-        query += ' AND (c.title LIKE ? OR c.description LIKE ?)'
-        params.extend([f'%{keyword}%', f'%{keyword}%'])
-    order_map = {'popular': 'c.enrollment_count DESC', 'rating': 'c.rating_avg DESC', 'price_low': 'c.price ASC', 'price_high': 'c.price DESC'}
-    query += f" ORDER BY {order_map.get(sort, 'c.published_at DESC')}"
-    c.execute(query, params)
-    courses_list = c.fetchall()
-    c.execute('SELECT * FROM category ORDER BY parent_id, sort_order')
-    categories = c.fetchall()
-    conn.close()
-    return render_template('courses.html', courses=courses_list, categories=categories, current_category=category_id, current_level=level, current_sort=sort, keyword=keyword)
+    if match:
+        query += ' AND course_fts MATCH ?'
+        params.append(match)
+    return pagination.paginate(conn, 'c.*, u.username as instructor_name, cat.category_name', query, params, sort, cursor, per_page)
 
 @app.route('/course/<int:course_id>')
 def course_detail(course_id):
     conn = get_db()
-    c = conn.cursor()
-    c.execute('''SELECT c.*, u.username as instructor_name, up.bio as instructor_bio, cat.category_name FROM course c
-        LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN user_profile up ON u.user_id = up.user_id
-        LEFT JOIN category cat ON c.category_id = cat.category_id WHERE c.course_id = ?''', (course_id,))
-    course = c.fetchone()
+    course_version, catalog_version = versions.course(conn, course_id)
+    course = pagecache.cached(f'course:{course_id}', course_version.tag, lambda: load_course(conn, course_id))
     if not course:
         flash('Course not found', 'error')
         return redirect(url_for('courses'))
-    c.execute('SELECT * FROM chapter WHERE course_id = ? ORDER BY sort_order', (course_id,))
-    chapters = c.fetchall()
-    chapters_with_lessons = []
-    for chapter in chapters:
-        c.execute('SELECT * FROM lesson WHERE chapter_id = ? ORDER BY sort_order', (chapter['chapter_id'],))
-        chapters_with_lessons.append({'chapter': chapter, 'lessons': c.fetchall()})
-    c.execute('SELECT r.*, u.username FROM review r LEFT JOIN user u ON r.user_id = u.user_id WHERE r.course_id = ? AND r.status = "approved" ORDER BY r.created_at DESC LIMIT 10', (course_id,))
-    reviews = c.fetchall()
+    # 只有选课/收藏状态按请求查询, 其余内容按版本号缓存
     is_enrolled = is_favorited = False
     if 'user_id' in session:
-        c.execute('SELECT * FROM enrollment WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
-        is_enrolled = c.fetchone() is not None
-        c.execute('SELECT * FROM favorite WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
-        is_favorited = c.fetchone() is not None
-    conn.close()
-    return render_template('course_detail.html', course=course, chapters=chapters_with_lessons, reviews=reviews, is_enrolled=is_enrolled, is_favorited=is_favorited)
+        is_enrolled = conn.execute('SELECT 1 FROM enrollment WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id)).fetchone() is not None
+        is_favorited = conn.execute('SELECT 1 FROM favorite WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id)).fetchone() is not None
+    def render():
+        chapters = pagecache.fragment(f'course:{course_id}:curriculum', course_version.tag, 'partials/course_curriculum.html',
+                                      lambda: {'chapters': curriculum.load_outline(conn, course_id).chapters})
+        reviews = pagecache.fragment(f'course:{course_id}:reviews', course_version.tag, 'partials/course_reviews.html', lambda: {'reviews': conn.execute('''
+            SELECT r.*, u.username FROM review r LEFT JOIN user u ON r.user_id = u.user_id
+            WHERE r.course_id = ? AND r.status = "approved" ORDER BY r.created_at DESC LIMIT 10''', (course_id,)).fetchall()})
+        similar_courses = pagecache.fragment(f'course:{course_id}:similar', catalog_version.tag, 'partials/similar_courses.html',
+                                             lambda: {'similar_courses': recommend.similar_courses(conn, course_id)})
+        return render_template('course_detail.html', course=course, curriculum=chapters, reviews=reviews, is_enrolled=is_enrolled, is_favorited=is_favorited,
+                               similar_courses=similar_courses)
+    last_modified = max(filter(None, (course_version.last_modified, catalog_version.last_modified)))
+    return pagecache.conditional(pagecache.etag('course', course_id, course_version.tag, catalog_version.tag, is_enrolled, is_favorited), last_modified, render)
+
+def load_course(conn, course_id):
+    row = conn.execute('''SELECT c.*, u.username as instructor_name, up.bio as instructor_bio, cat.category_name FROM course c
+        LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN user_profile up ON u.user_id = up.user_id
+        LEFT JOIN category cat ON c.category_id = cat.category_id WHERE c.course_id = ?''', (course_id,)).fetchone()
+    return dict(row) if row else None
 
 @app.route('/profile')
 @login_required
@@ -278,7 +323,6 @@ def profile():
         JOIN course c ON f.course_id = c.course_id LEFT JOIN user u ON c.instructor_id = u.user_id
         WHERE f.user_id = ? ORDER BY f.created_at DESC''', (session['user_id'],))
     favorites = c.fetchall()
-    conn.close()
     return render_template('profile.html', user=user, learning_courses=learning_courses, favorites=favorites)
 
 @app.route('/profile/edit', methods=['GET', 'POST'])
@@ -291,29 +335,24 @@ def edit_profile():
         location = request.form.get('location', '')
         occupation = request.form.get('occupation', '')
         gender = request.form.get('gender', '')
-        c.execute('UPDATE user_profile SET bio = ?, location = ?, occupation = ?, gender = ? WHERE user_id = ?', (bio, location, occupation, gender, session['user_id']))
-        conn.commit()
+        db.writer.execute('UPDATE user_profile SET bio = ?, location = ?, occupation = ?, gender = ? WHERE user_id = ?',
+                          (bio, location, occupation, gender, session['user_id'])).result(db.WRITE_TIMEOUT)
         flash('Profile updated', 'success')
         return redirect(url_for('profile'))
     c.execute('SELECT u.*, up.* FROM user u LEFT JOIN user_profile up ON u.user_id = up.user_id WHERE u.user_id = ?', (session['user_id'],))
     user = c.fetchone()
-    conn.close()
     return render_template('edit_profile.html', user=user)
 
 @app.route('/favorite/<int:course_id>', methods=['POST'])
 @login_required
 def toggle_favorite(course_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT * FROM favorite WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
-    if c.fetchone():
-        c.execute('DELETE FROM favorite WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
-        message, is_favorited = 'Removed from favorites', False
-    else:
-        c.execute('INSERT INTO favorite (user_id, course_id) VALUES (?, ?)', (session['user_id'], course_id))
-        message, is_favorited = 'Added to favorites', True
-    conn.commit()
-    conn.close()
+    def toggle(conn, user_id, course_id):
+        if conn.execute('DELETE FROM favorite WHERE user_id = ? AND course_id = ?', (user_id, course_id)).rowcount:
+            return False
+        conn.execute('INSERT INTO favorite (user_id, course_id) VALUES (?, ?)', (user_id, course_id))
+        return True
+    is_favorited = db.writer.call(toggle, session['user_id'], course_id)
+    message = 'Added to favorites' if is_favorited else 'Removed from favorites'
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify({'success': True, 'message': message, 'is_favorited': is_favorited})
     flash(message, 'success')
@@ -323,29 +362,14 @@ def toggle_favorite(course_id):
 @login_required
 def enroll_course(course_id):
     conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT * FROM course WHERE course_id = ?', (course_id,))
-    course = c.fetchone()
-    if not course:
+    outline = curriculum.get_outline(conn, course_id)
+    result = db.writer.call(enrollments.enroll, session['user_id'], course_id, outline.lesson_count)
+    if result == enrollments.COURSE_NOT_FOUND:
         flash('Course not found', 'error')
         return redirect(url_for('courses'))
-    c.execute('SELECT * FROM enrollment WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
-    if c.fetchone():
+    if result == enrollments.ALREADY_ENROLLED:
         flash('You have already enrolled in this course', 'warning')
         return redirect(url_for('course_detail', course_id=course_id))
-    order_no = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{session['user_id']:04d}"
-    price = course['price']
-    payment_method = 'free' if price == 0 else 'alipay'
-    c.execute('INSERT INTO "order" (order_no, user_id, total_amount, final_amount, payment_method, payment_status, paid_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
-              (order_no, session['user_id'], price, price, payment_method, 'paid', datetime.now()))
-    order_id = c.lastrowid
-    c.execute('INSERT INTO order_item (order_id, course_id, price) VALUES (?, ?, ?)', (order_id, course_id, price))
-    c.execute('SELECT COUNT(*) as total FROM lesson l JOIN chapter ch ON l.chapter_id = ch.chapter_id WHERE ch.course_id = ?', (course_id,))
-    total_lessons = c.fetchone()['total']
-    c.execute('INSERT INTO enrollment (user_id, course_id, order_id, total_lessons) VALUES (?, ?, ?, ?)', (session['user_id'], course_id, order_id, total_lessons))
-    c.execute('UPDATE course SET enrollment_count = enrollment_count + 1 WHERE course_id = ?', (course_id,))
-    conn.commit()
-    conn.close()
     flash('Enrollment successful! Start learning!', 'success')
     return redirect(url_for('learn', course_id=course_id))
 
@@ -354,61 +378,91 @@ def enroll_course(course_id):
 def learn(course_id):
     conn = get_db()
     c = conn.cursor()
-    c.execute('SELECT * FROM enrollment WHERE user_id = ? AND course_id = ?', (session['user_id'], course_id))
+    c.execute('''SELECT e.*, p.layout, p.completed, p.percents FROM enrollment e LEFT JOIN enrollment_progress p ON p.enrollment_id = e.enrollment_id
+        WHERE e.user_id = ? AND e.course_id = ?''', (session['user_id'], course_id))
     enrollment = c.fetchone()
     if not enrollment:
         flash('Please enroll first', 'warning')
         return redirect(url_for('course_detail', course_id=course_id))
     c.execute('SELECT * FROM course WHERE course_id = ?', (course_id,))
     course = c.fetchone()
-    c.execute('''SELECT ch.chapter_id, ch.title as chapter_title, ch.sort_order as chapter_order,
-        l.lesson_id, l.title as lesson_title, l.content_type, l.video_url, l.video_duration, l.sort_order as lesson_order
-        FROM chapter ch LEFT JOIN lesson l ON ch.chapter_id = l.chapter_id WHERE ch.course_id = ? ORDER BY ch.sort_order, l.sort_order''', (course_id,))
-    rows = c.fetchall()
-    chapters = {}
-    for row in rows:
-        ch_id = row['chapter_id']
-        if ch_id not in chapters:
-            chapters[ch_id] = {'chapter_id': ch_id, 'title': row['chapter_title'], 'lessons': []}
-        if row['lesson_id']:
-            chapters[ch_id]['lessons'].append({'lesson_id': row['lesson_id'], 'title': row['lesson_title'], 'content_type': row['content_type'], 'video_url': row['video_url'], 'video_duration': row['video_duration']})
-    c.execute('SELECT lesson_id, is_completed, progress_percent FROM learning_progress WHERE user_id = ?', (session['user_id'],))
-    progress_data = {row['lesson_id']: row for row in c.fetchall()}
-    lesson_id = request.args.get('lesson', type=int)
-    current_lesson = None
-    if lesson_id:
-        c.execute('SELECT * FROM lesson WHERE lesson_id = ?', (lesson_id,))
-        current_lesson = c.fetchone()
-    c.execute('UPDATE enrollment SET last_accessed_at = ? WHERE user_id = ? AND course_id = ?', (datetime.now(), session['user_id'], course_id))
-    conn.commit()
-    conn.close()
-    return render_template('learn.html', course=course, chapters=list(chapters.values()), current_lesson=current_lesson, progress_data=progress_data, enrollment=enrollment)
+    outline = curriculum.get_outline(conn, course_id)
+    course_progress = progress.course_progress(conn, enrollment, outline)
+    current_lesson = outline.lesson(request.args.get('lesson', type=int))
+    # 不等待写入完成, 与其他小写入一起提交
+    db.writer.execute('UPDATE enrollment SET last_accessed_at = ? WHERE enrollment_id = ?', (datetime.now(), enrollment['enrollment_id']))
+    return render_template('learn.html', course=course, chapters=outline.chapters, current_lesson=current_lesson, course_progress=course_progress, enrollment=enrollment)
+
+@app.route('/api/progress/heartbeat', methods=['POST'])
+def progress_heartbeat():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login first'}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('course_id'), int) or isinstance(data['course_id'], bool):
+        return jsonify({'success': False, 'message': 'Invalid heartbeat'}), 400
+    conn = get_db()
+    enrollment_id = progress.enrollment_id(conn, session['user_id'], data['course_id'])
+    if enrollment_id is None:
+        return jsonify({'success': False, 'message': 'Please enroll first'}), 403
+    outline = curriculum.get_outline(conn, data['course_id'])
+    events = data.get('events') if isinstance(data.get('events'), list) else [data]
+    accepted = 0
+    for event in events[:progress.MAX_EVENTS_PER_REQUEST]:
+        # lesson_id 须为整数 (bool 是 int 的子类, 单独排除); 列表、字典等不可哈希的值传给 outline.lesson 会抛异常
+        lesson_id = event.get('lesson_id') if isinstance(event, dict) else None
+        if not isinstance(lesson_id, int) or isinstance(lesson_id, bool):
+            continue
+        lesson = outline.lesson(lesson_id)
+        watched = event.get('watched_duration') if lesson else None
+        if not isinstance(watched, int) or isinstance(watched, bool) or watched < 0:
+            continue
+        progress.heartbeats.add(session['user_id'], lesson.lesson_id, enrollment_id, watched, lesson.video_duration)
+        accepted += 1
+    return jsonify({'success': True, 'accepted': accepted}), 202
+
+@app.route('/admin/course/<int:course_id>/enrollments', methods=['POST'])
+@login_required
+def enroll_cohort(course_id):
+    if not authz.has_role('admin'):
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    data = request.get_json(silent=True)
+    user_ids = data.get('user_ids', []) if isinstance(data, dict) else None
+    emails = data.get('emails', []) if isinstance(data, dict) else None
+    if not isinstance(user_ids, list) or not isinstance(emails, list) or not all(type(u) is int for u in user_ids) or not all(isinstance(e, str) for e in emails):
+        return jsonify({'success': False, 'message': 'Expected JSON with user_ids and/or emails'}), 400
+    if len(user_ids) + len(emails) > enrollments.MAX_COHORT_SIZE:
+        return jsonify({'success': False, 'message': f'At most {enrollments.MAX_COHORT_SIZE} users per request'}), 400
+    conn = get_db()
+    unknown = 0
+    if emails:
+        c = conn.execute('SELECT u.user_id FROM json_each(?) j JOIN user u ON u.email = j.value', (json.dumps(list(set(emails))),))
+        found = [row['user_id'] for row in c.fetchall()]
+        unknown = len(set(emails)) - len(found)
+        user_ids = user_ids + found
+    outline = curriculum.get_outline(conn, course_id)
+    result = db.writer.call(enrollments.enroll_cohort, course_id, user_ids, outline.lesson_count)
+    if result is None:
+        return jsonify({'success': False, 'message': 'Course not found'}), 404
+    enrolled, skipped = result
+    return jsonify({'success': True, 'enrolled': enrolled, 'skipped': skipped + unknown})
 
 # 课程管理 CRUD
 @app.route('/admin/courses')
-@login_required
+@roles_required('instructor', 'admin')
 def admin_courses():
-    if 'instructor' not in session.get('roles', []) and 'admin' not in session.get('roles', []):
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
     conn = get_db()
-    c = conn.cursor()
-    if 'admin' in session.get('roles', []):
-        c.execute('SELECT c.*, u.username as instructor_name, cat.category_name FROM course c LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id ORDER BY c.created_at DESC')
+    query = 'FROM course c LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id'
+    if authz.has_role('admin'):
+        query, params = query + ' WHERE 1', []
     else:
-        c.execute('SELECT c.*, u.username as instructor_name, cat.category_name FROM course c LEFT JOIN user u ON c.instructor_id = u.user_id LEFT JOIN category cat ON c.category_id = cat.category_id WHERE c.instructor_id = ? ORDER BY c.created_at DESC', (session['user_id'],))
-    courses_list = c.fetchall()
-    conn.close()
-    return render_template('admin/courses.html', courses=courses_list)
+        query, params = query + ' WHERE c.instructor_id = ?', [session['user_id']]
+    per_page = pagination.page_size(request.args.get('per_page', type=int), ADMIN_PAGE_SIZE)
+    page = pagination.paginate(conn, 'c.*, u.username as instructor_name, cat.category_name', query, params, 'created', request.args.get('cursor'), per_page)
+    return render_template('admin/courses.html', courses=page, per_page=None if per_page == ADMIN_PAGE_SIZE else per_page)
 
 @app.route('/admin/course/create', methods=['GET', 'POST'])
-@login_required
+@roles_required('instructor', 'admin')
 def create_course():
-    if 'instructor' not in session.get('roles', []) and 'admin' not in session.get('roles', []):
-        flash('Access denied', 'error')
-        return redirect(url_for('index'))
-    conn = get_db()
-    c = conn.cursor()
     if request.method == 'POST':
         title = request.form.get('title', '').strip()
         subtitle = request.form.get('subtitle', '').strip()
@@ -420,27 +474,20 @@ def create_course():
         if not title:
             flash('Please enter course title', 'error')
         else:
-            c.execute('INSERT INTO course (title, subtitle, description, instructor_id, category_id, price, original_price, level, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                      (title, subtitle, description, session['user_id'], category_id, price, original_price, level, 'draft'))
-            conn.commit()
+            db.writer.execute('INSERT INTO course (title, subtitle, description, instructor_id, category_id, price, original_price, level, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (title, subtitle, description, session['user_id'], category_id, price, original_price, level, 'draft')).result(db.WRITE_TIMEOUT)
+            authz.invalidate()
+            invalidate_catalog()
             flash('Course created successfully', 'success')
             return redirect(url_for('admin_courses'))
-    c.execute('SELECT * FROM category ORDER BY parent_id, sort_order')
-    categories = c.fetchall()
-    conn.close()
+    categories = all_categories()
     return render_template('admin/course_form.html', course=None, categories=categories)
 
 @app.route('/admin/course/<int:course_id>/edit', methods=['GET', 'POST'])
-@login_required
+@roles_required('instructor', 'admin')
 def edit_course(course_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT * FROM course WHERE course_id = ?', (course_id,))
-    course = c.fetchone()
-    if not course:
-        flash('Course not found', 'error')
-        return redirect(url_for('admin_courses'))
-    if 'admin' not in session.get('roles', []) and course['instructor_id'] != session['user_id']:
+    # 归属在内存中检查; 课程行只在展示表单时读取, 不存在的课程由 UPDATE 影响行数判断
+    if not authz.can_manage(course_id):
         flash('No permission to edit this course', 'error')
         return redirect(url_for('admin_courses'))
     if request.method == 'POST':
@@ -452,71 +499,114 @@ def edit_course(course_id):
         original_price = request.form.get('original_price', type=float) or price
         level = request.form.get('level', 'beginner')
         status = request.form.get('status', 'draft')
-        c.execute('UPDATE course SET title = ?, subtitle = ?, description = ?, category_id = ?, price = ?, original_price = ?, level = ?, status = ? WHERE course_id = ?',
-                  (title, subtitle, description, category_id, price, original_price, level, status, course_id))
-        if status == 'published' and not course['published_at']:
-            c.execute('UPDATE course SET published_at = ? WHERE course_id = ?', (datetime.now(), course_id))
-        conn.commit()
+        if not db.writer.execute('''UPDATE course SET title = ?, subtitle = ?, description = ?, category_id = ?, price = ?, original_price = ?, level = ?, status = ?,
+            published_at = CASE WHEN ? = 'published' THEN COALESCE(published_at, ?) ELSE published_at END WHERE course_id = ?''',
+                                 (title, subtitle, description, category_id, price, original_price, level, status, status, datetime.now(), course_id)).result(db.WRITE_TIMEOUT):
+            flash('Course not found', 'error')
+            return redirect(url_for('admin_courses'))
+        invalidate_catalog()
+        curriculum.invalidate(course_id)
         flash('Course updated', 'success')
         return redirect(url_for('admin_courses'))
-    c.execute('SELECT * FROM category ORDER BY parent_id, sort_order')
-    categories = c.fetchall()
-    conn.close()
+    course = get_db().execute('SELECT * FROM course WHERE course_id = ?', (course_id,)).fetchone()
+    if not course:
+        flash('Course not found', 'error')
+        return redirect(url_for('admin_courses'))
+    categories = all_categories()
     return render_template('admin/course_form.html', course=course, categories=categories)
 
 @app.route('/admin/course/<int:course_id>/delete', methods=['POST'])
-@login_required
+@roles_required('instructor', 'admin')
 def delete_course(course_id):
-    conn = get_db()
-    c = conn.cursor()
-    c.execute('SELECT * FROM course WHERE course_id = ?', (course_id,))
-    course = c.fetchone()
-    if not course:
-        flash('Course not found', 'error')
-        return redirect(url_for('admin_courses'))
-    if 'admin' not in session.get('roles', []) and course['instructor_id'] != session['user_id']:
+    if not authz.can_manage(course_id):
         flash('No permission to delete this course', 'error')
         return redirect(url_for('admin_courses'))
-    c.execute('SELECT COUNT(*) as count FROM enrollment WHERE course_id = ?', (course_id,))
-    if c.fetchone()['count'] > 0:
-        flash('Cannot delete course with enrolled students', 'error')
+    # 检查与删除在同一条语句中完成, 避免检查之后又有学员选课
+    if not db.writer.execute('DELETE FROM course WHERE course_id = ? AND NOT EXISTS (SELECT 1 FROM enrollment WHERE course_id = ?)', (course_id, course_id)).result(db.WRITE_TIMEOUT):
+        if get_db().execute('SELECT 1 FROM course WHERE course_id = ?', (course_id,)).fetchone():
+            flash('Cannot delete course with enrolled students', 'error')
+        else:
+            flash('Course not found', 'error')
         return redirect(url_for('admin_courses'))
-    c.execute('DELETE FROM course WHERE course_id = ?', (course_id,))
-    conn.commit()
-    conn.close()
+    authz.invalidate()
+    invalidate_catalog()
+    curriculum.invalidate(course_id)
     flash('Course deleted', 'success')
     return redirect(url_for('admin_courses'))
 
+@app.route('/admin/reports/<report>')
+@roles_required('instructor', 'admin')
+def admin_report(report):
+    """选课/学习进度/收入报表流式导出 (?format=csv|jsonl, 可选 ?course_id=), 讲师只能导出自己的课程"""
+    fmt = request.args.get('format', 'csv')
+    if report not in reports.REPORTS or fmt not in reports.FORMATS:
+        return render_template('404.html'), 404
+    instructor_id = None if authz.has_role('admin') else session['user_id']
+    return reports.export(report, fmt, instructor_id, request.args.get('course_id', type=int), compress=request.accept_encodings['gzip'] > 0)
+
 # SQL查询演示
 @app.route('/demo/queries')
 def demo_queries():
-    conn = get_db()
-    c = conn.cursor()
-    queries = {}
-    c.execute('SELECT course_id, title, price, level, rating_avg, enrollment_count FROM course WHERE price > 100 AND status = "published" ORDER BY rating_avg DESC')
-    queries['single_table'] = {'title': '单表查询 - 价格>100的已发布课程', 'sql': "SELECT ... FROM course WHERE price > 100 AND status = 'published'", 'result': c.fetchall()}
-    c.execute('SELECT c.title, c.price, u.username as instructor, cat.category_name FROM course c INNER JOIN user u ON c.instructor_id = u.user_id INNER JOIN category cat ON c.category_id = cat.category_id WHERE c.status = "published"')
-    queries['inner_join'] = {'title': '内连接 - 课程与讲师、分类', 'sql': "SELECT ... FROM course c INNER JOIN user u ... INNER JOIN category cat ...", 'result': c.fetchall()}
-    c.execute('SELECT c.title, c.price, COUNT(r.review_id) as review_count FROM course c LEFT JOIN review r ON c.course_id = r.course_id WHERE c.status = "published" GROUP BY c.course_id')
-    queries['left_join'] = {'title': '左外连接 - 课程及评价数量', 'sql': "SELECT ... FROM course c LEFT JOIN review r ... GROUP BY ...", 'result': c.fetchall()}
-    c.execute('SELECT c.category_name as category, COALESCE(p.category_name, "顶级分类") as parent FROM category c LEFT JOIN category p ON c.parent_id = p.category_id')
-    queries['self_join'] = {'title': '自连接 - 分类层级关系', 'sql': "SELECT c.category_name, p.category_name FROM category c LEFT JOIN category p ON c.parent_id = p.category_id", 'result': c.fetchall()}
-    c.execute('SELECT u.username, COUNT(c.course_id) as course_count, SUM(c.enrollment_count) as total_students, ROUND(AVG(c.rating_avg), 2) as avg_rating FROM user u JOIN course c ON u.user_id = c.instructor_id WHERE c.status = "published" GROUP BY u.user_id ORDER BY total_students DESC')
-    queries['aggregate'] = {'title': '聚合函数 - 讲师统计', 'sql': "SELECT ... COUNT(), SUM(), AVG() ... GROUP BY ... ORDER BY ...", 'result': c.fetchall()}
-    c.execute('SELECT DATE(created_at) as order_date, COUNT(*) as order_count, SUM(final_amount) as daily_revenue FROM "order" WHERE payment_status = "paid" GROUP BY DATE(created_at) ORDER BY order_date DESC')
-    queries['date_functions'] = {'title': '日期函数 - 按日订单统计', 'sql': "SELECT DATE(created_at), COUNT(*), SUM() ... GROUP BY DATE(created_at)", 'result': c.fetchall()}
-    c.execute('SELECT title, price, enrollment_count FROM course WHERE enrollment_count > (SELECT AVG(enrollment_count) FROM course WHERE status = "published") AND status = "published"')
-    queries['subquery'] = {'title': '子查询 - 报名数超过平均值的课程', 'sql': "SELECT ... WHERE enrollment_count > (SELECT AVG(...) ...)", 'result': c.fetchall()}
-    c.execute('SELECT c.title, c.rating_avg, cat.category_name FROM course c JOIN category cat ON c.category_id = cat.category_id WHERE c.rating_avg = (SELECT MAX(c2.rating_avg) FROM course c2 WHERE c2.category_id = c.category_id AND c2.status = "published") AND c.status = "published"')
-    queries['correlated_subquery'] = {'title': '相关子查询 - 每个分类评分最高的课程', 'sql': "SELECT ... WHERE rating_avg = (SELECT MAX(...) WHERE c2.category_id = c.category_id ...)", 'result': c.fetchall()}
-    c.execute('SELECT c.title, "已购买" as source FROM course c JOIN enrollment e ON c.course_id = e.course_id WHERE e.user_id = 1 UNION SELECT c.title, "已收藏" as source FROM course c JOIN favorite f ON c.course_id = f.course_id WHERE f.user_id = 1')
-    queries['union'] = {'title': 'UNION - 用户1的收藏和已购课程', 'sql': "SELECT ... UNION SELECT ...", 'result': c.fetchall()}
-    c.execute('SELECT u.username, c.title, e.progress_percent, cat.category_name, inst.username as instructor FROM user u JOIN enrollment e ON u.user_id = e.user_id JOIN course c ON e.course_id = c.course_id LEFT JOIN category cat ON c.category_id = cat.category_id JOIN user inst ON c.instructor_id = inst.user_id WHERE u.user_id = 1')
-    queries['multi_join'] = {'title': '多表连接 - 用户学习报告', 'sql': "SELECT ... FROM user u JOIN enrollment e JOIN course c LEFT JOIN category cat JOIN user inst ...", 'result': c.fetchall()}
-    c.execute('SELECT u.user_id, u.username, COUNT(DISTINCT e.course_id) as completed_courses FROM user u JOIN enrollment e ON u.user_id = e.user_id JOIN course c ON e.course_id = c.course_id WHERE c.instructor_id = 3 AND c.status = "published" AND e.status = "completed" GROUP BY u.user_id HAVING completed_courses = (SELECT COUNT(*) FROM course WHERE instructor_id = 3 AND status = "published")')
-    queries['division'] = {'title': '除法查询 - 学完讲师3所有课程的学员', 'sql': "SELECT ... HAVING completed_courses = (SELECT COUNT(*) ...)", 'result': c.fetchall()}
+    return render_template('demo_queries.html', snapshot=analytics.snapshots.latest())
+
+@app.route('/demo/queries/timings')
+def demo_query_timings():
+    snapshot = analytics.snapshots.latest()
+    return jsonify({'generated_at': snapshot.generated_at.isoformat(), 'age_seconds': round(snapshot.age_seconds, 1),
+                    'elapsed_ms': snapshot.elapsed_ms, 'queries': snapshot.timings(), 'history': analytics.snapshots.history})
+
+@app.cli.command('migrate')
+def migrate_command():
+    """执行尚未执行的数据库结构迁移"""
+    applied = migrations.migrate(db.DATABASE)
+    print(f'{applied} migration(s) applied, schema version {migrations.LATEST}')
+
+@app.cli.command('seed')
+def seed_command():
+    """导入示例数据; 库中已有用户时不做任何修改"""
+    print('Sample data loaded' if seed_sample_data() else 'Database already has users, sample data not loaded')
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """重建课程全文索引"""
+    conn = db.connect()
+    search.rebuild(conn)
+    conn.commit()
+    conn.close()
+    print('Search index rebuilt')
+
+@app.cli.command('rebuild-categories')
+def rebuild_categories_command():
+    """重建分类闭包表与各分类课程数"""
+    conn = db.connect()
+    taxonomy.rebuild(conn)
+    conn.commit()
+    conn.close()
+    cache.catalog.invalidate('categories:all')
+    print('Category closure rebuilt')
+
+@app.cli.command('build-recommendations')
+@click.option('--refresh', is_flag=True, help='Only fold in enrollments/favorites added since the last run')
+@click.option('--top-k', default=recommend.TOP_K, show_default=True)
+@click.option('--shards', type=int, help='Number of passes over the source rows (default: sized to the memory budget)')
+def build_recommendations_command(refresh, top_k, shards):
+    """计算"学过这门课的同学还学了"推荐"""
+    conn = db.connect()
+    if refresh:
+        print(f'{recommend.refresh(conn, top_k)} course(s) refreshed')
+    else:
+        pairs, courses = recommend.build(conn, top_k, shards)
+        print(f'{pairs} course pairs, recommendations for {courses} course(s)')
+    conn.close()
+
+@app.cli.command('reconcile-aggregates')
+@click.option('--dry-run', is_flag=True, help='Only report drift, do not repair it')
+def reconcile_aggregates_command(dry_run):
+    """核对并修复课程评分/报名数汇总"""
+    conn = db.connect()
+    drifted = aggregates.reconcile(conn, repair=not dry_run)
     conn.close()
-    return render_template('demo_queries.html', queries=queries)
+    print(f"{drifted} course(s) with drifted aggregates{'' if dry_run else ' repaired'}")
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -0,0 +1,145 @@
+"""
+权限上下文缓存 - 用户角色与讲师名下课程 ID 缓存在进程内, 角色与归属检查不再查库
+
+acl_version 记录每个用户权限相关数据的版本号, 由触发器在 user_role 增删改、课程增删或更换讲师、用户状态变化时更新为
+全局最大值 + 1. 每个进程每 VERSION_CHECK_INTERVAL 秒用一次索引查询取出新变化的用户并淘汰其缓存, 其他 worker 或命令行
+工具撤销的角色也会在一个周期内生效; 本进程内的修改直接调用 invalidate(). AUTH_CACHE_TTL 兜底: 即使错过了变更通知,
+缓存也最多使用这么久
+"""
+import json
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, session
+
+import cache
+from db import get_db
+
+AUTH_CACHE_TTL = 300
+AUTH_CACHE_ENTRIES = 4096
+VERSION_CHECK_INTERVAL = 1.0
+
+
+def _bump(user, where='1'):
+    return f'''INSERT INTO acl_version (user_id, version) SELECT {user}, v FROM (SELECT COALESCE(MAX(version), 0) + 1 AS v FROM acl_version) WHERE {where}
+        ON CONFLICT (user_id) DO UPDATE SET version = excluded.version;'''
+
+
+SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS acl_version (user_id INTEGER PRIMARY KEY, version INTEGER NOT NULL);
+    CREATE INDEX IF NOT EXISTS idx_acl_version ON acl_version (version);
+    CREATE TRIGGER IF NOT EXISTS acl_version_user_role_ai AFTER INSERT ON user_role BEGIN
+        {_bump('new.user_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_user_role_au AFTER UPDATE ON user_role BEGIN
+        {_bump('old.user_id')}
+        {_bump('new.user_id', 'new.user_id != old.user_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_user_role_ad AFTER DELETE ON user_role BEGIN
+        {_bump('old.user_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_user_au AFTER UPDATE OF status ON user BEGIN
+        {_bump('new.user_id', 'new.status IS NOT old.status')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_course_ai AFTER INSERT ON course BEGIN
+        {_bump('new.instructor_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_course_au AFTER UPDATE OF instructor_id ON course WHEN new.instructor_id IS NOT old.instructor_id BEGIN
+        {_bump('old.instructor_id')}
+        {_bump('new.instructor_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS acl_version_course_ad AFTER DELETE ON course BEGIN
+        {_bump('old.instructor_id')}
+    END;
+'''
+
+# 一条语句读出, 角色、名下课程与版本号来自同一个快照; 被禁用的用户没有任何角色
+_LOAD = '''SELECT (SELECT version FROM acl_version WHERE user_id = u.user_id) AS version,
+    (SELECT json_group_array(r.role_name) FROM user_role ur JOIN role r ON r.role_id = ur.role_id WHERE ur.user_id = u.user_id AND u.status = 'active') AS roles,
+    (SELECT json_group_array(c.course_id) FROM course c WHERE c.instructor_id = u.user_id) AS courses
+    FROM user u WHERE u.user_id = ?'''
+
+
+class Principal(namedtuple('Principal', 'user_id roles courses version')):
+    """roles: 角色名集合; courses: 名下课程 ID 集合; version: 加载时的 acl_version"""
+
+    def has_role(self, *roles):
+        return not self.roles.isdisjoint(roles)
+
+    def can_manage(self, course_id):
+        return 'admin' in self.roles or course_id in self.courses
+
+
+class PrincipalCache:
+    def __init__(self, max_entries=AUTH_CACHE_ENTRIES, ttl=AUTH_CACHE_TTL):
+        self.local = cache.LRUCache(max_entries, ttl)
+        # 用户 ID -> 最近一次变更的版本号; 早于它加载的条目作废 (覆盖"加载途中发生变更"的情况)
+        self._changed = cache.LRUCache(max_entries, ttl)
+        self._version = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _sync(self, conn):
+        if time.monotonic() - self._checked < VERSION_CHECK_INTERVAL:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked < VERSION_CHECK_INTERVAL:
+                return
+            if self._version is None:
+                self._version = conn.execute('SELECT COALESCE(MAX(version), 0) FROM acl_version').fetchone()[0]
+            else:
+                for user_id, version in conn.execute('SELECT user_id, version FROM acl_version WHERE version > ?', (self._version,)).fetchall():
+                    self._changed.set(user_id, version)
+                    self.local.delete(user_id)
+                    self._version = max(self._version, version)
+            self._checked = now
+
+    def _load(self, conn, user_id):
+        row = conn.execute(_LOAD, (user_id,)).fetchone()
+        if row is None:
+            return Principal(user_id, frozenset(), frozenset(), 0)
+        return Principal(user_id, frozenset(json.loads(row['roles'])), frozenset(json.loads(row['courses'])), row['version'] or 0)
+
+    def get(self, conn, user_id):
+        self._sync(conn)
+        principal = self.local.get(user_id)
+        changed = self._changed.get(user_id)
+        if principal is cache.MISSING or (changed is not cache.MISSING and principal.version < changed):
+            principal = self._load(conn, user_id)
+            self.local.set(user_id, principal)
+        return principal
+
+    def invalidate(self, user_id):
+        self.local.delete(user_id)
+
+
+principals = PrincipalCache()
+
+
+def current():
+    """当前登录用户的 Principal, 同一请求内只取一次; 未登录时为 None"""
+    if 'user_id' not in session:
+        return None
+    if 'principal' not in g:
+        g.principal = principals.get(get_db(), session['user_id'])
+    return g.principal
+
+
+def has_role(*roles):
+    principal = current()
+    return principal is not None and principal.has_role(*roles)
+
+
+def can_manage(course_id):
+    """管理员可以管理所有课程, 讲师只能管理自己名下的课程"""
+    principal = current()
+    return principal is not None and principal.can_manage(course_id)
+
+
+def invalidate():
+    """本进程内修改了当前用户的角色或名下课程后调用, 下次检查重新加载"""
+    if 'user_id' in session:
+        principals.invalidate(session['user_id'])
+        g.pop('principal', None)
@@ -0,0 +1,227 @@
+"""
+压测数据生成 - 以固定随机种子按指定规模填充 init_db() 中的所有表
+
+课程热度服从 Zipf 分布, 用户的选课数/学习进度也带有长尾; 数据按块 executemany 并分批提交
+
+用法: python -m bench.datagen --db /tmp/bench.db --preset medium
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+PRESETS = {
+    'small': dict(users=10000, courses=1000, progress=200000),
+    'medium': dict(users=100000, courses=10000, progress=2000000),
+    'large': dict(users=1000000, courses=100000, progress=20000000),
+}
+CHUNK_SIZE = 50000
+INSTRUCTOR_RATIO = 0.01
+ZIPF_EXPONENT = 1.1
+LEVELS = ('beginner', 'intermediate', 'advanced')
+PAYMENT_METHODS = ('alipay', 'wechat', 'credit_card', 'paypal')
+START_DATE = datetime(2023, 1, 1)
+PASSWORD_HASH = hashlib.sha256('password123'.encode()).hexdigest()
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_insert(conn, sql, rows):
+    """按块写入, 每块一个事务; 返回写入行数"""
+    total = 0
+    for chunk in chunked(rows):
+        conn.execute('BEGIN')
+        conn.executemany(sql, chunk)
+        conn.commit()
+        total += len(chunk)
+    return total
+
+
+def next_id(conn, table, column):
+    return (conn.execute(f'SELECT MAX({column}) FROM "{table}"').fetchone()[0] or 0) + 1
+
+
+class Generator:
+    def __init__(self, conn, users, courses, progress, seed=42):
+        self.conn = conn
+        self.rng = random.Random(seed)
+        self.n_users = users
+        self.n_courses = courses
+        self.n_progress = progress
+        self.first_user = next_id(conn, 'user', 'user_id')
+        self.first_course = next_id(conn, 'course', 'course_id')
+        self.user_ids = range(self.first_user, self.first_user + users)
+        self.course_ids = range(self.first_course, self.first_course + courses)
+        self.instructors = self.user_ids[:max(1, int(users * INSTRUCTOR_RATIO))]
+        # 课程热度: 排名越靠前被选中的概率越高
+        weights = [1.0 / (rank + 1) ** ZIPF_EXPONENT for rank in range(courses)]
+        self.course_cum_weights = list(itertools.accumulate(weights))
+        self.course_lessons = {}
+        self.course_price = {}
+        self.enrollments = []
+
+    def date(self, days=720):
+        return (START_DATE + timedelta(seconds=self.rng.randrange(days * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+    def popular_courses(self, k):
+        return self.rng.choices(self.course_ids, cum_weights=self.course_cum_weights, k=k)
+
+    def run(self, log=print):
+        steps = [('user', self.users), ('user_profile', self.profiles), ('user_role', self.user_roles), ('category', self.categories),
+                 ('course', self.courses), ('chapter/lesson', self.curriculum), ('order/enrollment', self.enroll),
+                 ('learning_progress', self.progress), ('review', self.reviews), ('favorite', self.favorites), ('cart', self.carts)]
+        for name, step in steps:
+            started = time.perf_counter()
+            rows = step()
+            log('%-18s %10d rows  %6.1fs' % (name, rows, time.perf_counter() - started))
+
+    def users(self):
+        return bulk_insert(self.conn, 'INSERT INTO user (user_id, username, email, password_hash, phone, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           ((uid, f'user{uid}', f'user{uid}@bench.example.com', PASSWORD_HASH, f'1{uid:010d}', 'active' if self.rng.random() > 0.01 else 'disabled', self.date())
+                            for uid in self.user_ids))
+
+    def profiles(self):
+        return bulk_insert(self.conn, 'INSERT INTO user_profile (user_id, bio, gender, location, occupation) VALUES (?, ?, ?, ?, ?)',
+                           ((uid, f'Bio of user {uid}', self.rng.choice(('male', 'female', 'other')), f'City {uid % 500}', f'Occupation {uid % 50}')
+                            for uid in self.user_ids if self.rng.random() < 0.6))
+
+    def user_roles(self):
+        instructors = set(self.instructors)
+        return bulk_insert(self.conn, 'INSERT INTO user_role (user_id, role_id) VALUES (?, ?)', ((uid, 2 if uid in instructors else 1) for uid in self.user_ids))
+
+    def categories(self):
+        first = next_id(self.conn, 'category', 'category_id')
+        rows, parents = [], []
+        for i in range(10):
+            cid = first + len(rows)
+            parents.append(cid)
+            rows.append((cid, f'Bench Category {i}', None, f'Top level {i}', i))
+            for j in range(5):
+                sub = first + len(rows)
+                rows.append((sub, f'Bench Category {i}.{j}', cid, f'Sub category {i}.{j}', j))
+                for k in range(3):
+                    rows.append((first + len(rows), f'Bench Category {i}.{j}.{k}', sub, f'Leaf {i}.{j}.{k}', k))
+        self.category_ids = [row[0] for row in rows]
+        return bulk_insert(self.conn, 'INSERT INTO category (category_id, category_name, parent_id, description, sort_order) VALUES (?, ?, ?, ?, ?)', rows)
+
+    def courses(self):
+        def rows():
+            for cid in self.course_ids:
+                price = self.rng.choice((0, 49, 99, 149, 199, 299, 399, 499))
+                self.course_price[cid] = price
+                status = 'published' if self.rng.random() < 0.9 else self.rng.choice(('draft', 'archived'))
+                created = self.date()
+                yield (cid, f'Course {cid} {self.rng.choice(("Python", "Java", "Web", "Data", "Cloud", "AI", "Design"))} {self.rng.choice(("Basics", "in Action", "Mastery", "Deep Dive"))}',
+                       f'Subtitle {cid}', f'Description of course {cid} topic{cid % 997} keyword{cid % 101}', self.rng.choice(self.instructors),
+                       self.rng.choice(self.category_ids), price, price * 2, self.rng.choice(LEVELS), round(self.rng.uniform(2, 80), 1), status,
+                       int(self.rng.random() < 0.05), created, created if status == 'published' else None)
+        return bulk_insert(self.conn, '''INSERT INTO course (course_id, title, subtitle, description, instructor_id, category_id, price, original_price, level, duration_hours, status, is_featured, created_at, published_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows())
+
+    def curriculum(self):
+        chapter_id, lesson_id = next_id(self.conn, 'chapter', 'chapter_id'), next_id(self.conn, 'lesson', 'lesson_id')
+        chapters, lessons = [], []
+        for cid in self.course_ids:
+            first_lesson = lesson_id
+            for ch in range(1, self.rng.randint(2, 10) + 1):
+                chapters.append((chapter_id, cid, f'Chapter {ch}', f'Chapter {ch} of course {cid}', ch, int(ch == 1)))
+                for ls in range(1, self.rng.randint(2, 8) + 1):
+                    lessons.append((lesson_id, chapter_id, f'{ch}.{ls} Lesson', 'video', f'https://example.com/{lesson_id}.mp4', self.rng.randint(120, 1800), ls, int(ch == 1)))
+                    lesson_id += 1
+                chapter_id += 1
+            self.course_lessons[cid] = (first_lesson, lesson_id - first_lesson)
+        total = bulk_insert(self.conn, 'INSERT INTO chapter (chapter_id, course_id, title, description, sort_order, is_free) VALUES (?, ?, ?, ?, ?, ?)', chapters)
+        return total + bulk_insert(self.conn, 'INSERT INTO lesson (lesson_id, chapter_id, title, content_type, video_url, video_duration, sort_order, is_free) VALUES (?, ?, ?, ?, ?, ?, ?, ?)', lessons)
+
+    def enroll(self):
+        order_id, enrollments = next_id(self.conn, 'order', 'order_id'), []
+        orders, items = [], []
+        for uid in self.user_ids:
+            # 大多数用户只选一两门课, 少数重度用户选很多
+            count = min(int(self.rng.paretovariate(1.3)), 50)
+            for cid in set(self.popular_courses(count)):
+                price, paid_at = self.course_price[cid], self.date()
+                orders.append((order_id, f'GEN{order_id:012d}', uid, price, price, 'free' if price == 0 else self.rng.choice(PAYMENT_METHODS), 'paid', paid_at, paid_at))
+                items.append((order_id, cid, price))
+                enrollments.append((uid, cid, order_id, self.course_lessons[cid][1], paid_at))
+                order_id += 1
+        self.enrollments = [(uid, cid) for uid, cid, _, _, _ in enrollments]
+        total = bulk_insert(self.conn, 'INSERT INTO "order" (order_id, order_no, user_id, total_amount, final_amount, payment_method, payment_status, paid_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', orders)
+        total += bulk_insert(self.conn, 'INSERT INTO order_item (order_id, course_id, price) VALUES (?, ?, ?)', items)
+        return total + bulk_insert(self.conn, 'INSERT INTO enrollment (user_id, course_id, order_id, total_lessons, enrolled_at) VALUES (?, ?, ?, ?, ?)', enrollments)
+
+    def progress(self):
+        if not self.enrollments:
+            return 0
+        per_enrollment = self.n_progress / len(self.enrollments)
+
+        def rows():
+            produced = 0
+            for uid, cid in self.enrollments:
+                first, count = self.course_lessons[cid]
+                watched = min(count, int(self.rng.expovariate(1 / per_enrollment)) if per_enrollment else 0)
+                for lid in range(first, first + watched):
+                    if produced >= self.n_progress:
+                        return
+                    done = self.rng.random() < 0.8
+                    yield (uid, lid, self.rng.randint(60, 1800), 100.0 if done else round(self.rng.uniform(1, 90), 2), int(done))
+                    produced += 1
+        return bulk_insert(self.conn, 'INSERT INTO learning_progress (user_id, lesson_id, watched_duration, progress_percent, is_completed) VALUES (?, ?, ?, ?, ?)', rows())
+
+    def reviews(self):
+        return bulk_insert(self.conn, 'INSERT INTO review (user_id, course_id, rating, content, helpful_count, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           ((uid, cid, self.rng.choices((1, 2, 3, 4, 5), (1, 1, 3, 8, 12))[0], f'Review of course {cid}', self.rng.randint(0, 50),
+                             'approved' if self.rng.random() < 0.95 else 'pending', self.date())
+                            for uid, cid in self.enrollments if self.rng.random() < 0.2))
+
+    def favorites(self):
+        return bulk_insert(self.conn, 'INSERT OR IGNORE INTO favorite (user_id, course_id, created_at) VALUES (?, ?, ?)',
+                           ((uid, cid, self.date()) for uid in self.user_ids for cid in set(self.popular_courses(self.rng.randint(0, 3)))))
+
+    def carts(self):
+        return bulk_insert(self.conn, 'INSERT OR IGNORE INTO cart (user_id, course_id) VALUES (?, ?)',
+                           ((uid, cid) for uid in self.user_ids if self.rng.random() < 0.3 for cid in set(self.popular_courses(self.rng.randint(1, 2)))))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fill the database with deterministic synthetic data')
+    parser.add_argument('--db', required=True, help='SQLite file to create or extend')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--courses', type=int)
+    parser.add_argument('--progress', type=int, help='Approximate number of learning_progress rows')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+    scale = dict(PRESETS[args.preset])
+    scale.update({k: v for k, v in (('users', args.users), ('courses', args.courses), ('progress', args.progress)) if v is not None})
+
+    os.environ['LEARNING_PLATFORM_DB'] = os.path.abspath(args.db)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import app
+    import db
+    # 示例数据提供压测用的管理员账号 (admin@example.com)
+    app.seed_sample_data()
+    # 绕过 db.connect() 的 SQL 监控, 批量写入不计入慢查询
+    conn = sqlite3.connect(db.DATABASE, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    started = time.perf_counter()
+    Generator(conn, seed=args.seed, **scale).run()
+    conn.execute('ANALYZE')
+    conn.close()
+    print('done in %.1fs' % (time.perf_counter() - started))
+
+
+if __name__ == '__main__':
+    main()
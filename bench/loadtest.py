@@ -0,0 +1,335 @@
+"""
+压测驱动 - 以多种身份并发访问所有路由, 统计每个场景的吞吐量与 p50/p95/p99 延迟
+
+默认在进程内通过 Flask 测试客户端发请求; 指定 --url 时改为请求已启动的服务 (--db 须与服务使用同一数据库文件,
+用于抽取真实的课程/学员 ID). 结果写成 JSON, 可用 --compare 与上一版本的基线对比
+
+用法: python -m bench.loadtest --db /tmp/bench.db --duration 30 --concurrency 8 --output baseline.json
+"""
+import argparse
+import http.cookiejar
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
+
+PASSWORD = 'password123'
+SAMPLE_SIZE = 1000
+# 延迟 (p50/p95/p99) 或吞吐量变差超过该比例视为回归
+REGRESSION_THRESHOLD = 0.2
+
+
+class Scenario:
+    def __init__(self, name, endpoint, persona, weight, build):
+        self.name = name
+        self.endpoint = endpoint
+        self.persona = persona
+        self.weight = weight
+        # build(worker, rng) -> (method, path, form, json)
+        self.build = build
+
+
+def _get(path):
+    return 'GET', path, None, None
+
+
+SCENARIOS = [
+    Scenario('index', 'index', 'anon', 10, lambda w, rng: _get('/')),
+    Scenario('courses', 'courses', 'anon', 10, lambda w, rng: _get('/courses?sort=%s' % rng.choice(('newest', 'popular', 'rating', 'price_low', 'price_high')))),
+    Scenario('courses_category', 'courses', 'anon', 5, lambda w, rng: _get('/courses?category=%d' % rng.choice(w.ctx.categories))),
+    Scenario('courses_search', 'courses', 'anon', 5, lambda w, rng: _get('/courses?keyword=%s' % rng.choice(('python', 'java', 'data', 'web', 'design', 'cloud')))),
+    Scenario('courses_next_page', 'courses', 'anon', 3, lambda w, rng: _get(w.ctx.next_page_url or '/courses')),
+    Scenario('course_detail', 'course_detail', 'anon', 15, lambda w, rng: _get('/course/%d' % rng.choice(w.ctx.courses))),
+    Scenario('course_detail_student', 'course_detail', 'student', 5, lambda w, rng: _get('/course/%d' % rng.choice(w.ctx.courses))),
+    Scenario('register_form', 'register', 'anon', 1, lambda w, rng: _get('/register')),
+    Scenario('register', 'register', 'anon', 1, lambda w, rng: ('POST', '/register', _new_account(rng), None)),
+    Scenario('login_form', 'login', 'anon', 1, lambda w, rng: _get('/login')),
+    Scenario('login', 'login', 'anon', 2, lambda w, rng: ('POST', '/login', {'email': rng.choice(w.ctx.students)[0], 'password': PASSWORD}, None)),
+    Scenario('logout', 'logout', 'anon', 1, lambda w, rng: _get('/logout')),
+    Scenario('profile', 'profile', 'student', 5, lambda w, rng: _get('/profile')),
+    Scenario('edit_profile_form', 'edit_profile', 'student', 1, lambda w, rng: _get('/profile/edit')),
+    Scenario('edit_profile', 'edit_profile', 'student', 1, lambda w, rng: ('POST', '/profile/edit', {'bio': 'bench %d' % rng.randrange(10 ** 6), 'location': 'Bench', 'occupation': 'Tester', 'gender': 'other'}, None)),
+    Scenario('toggle_favorite', 'toggle_favorite', 'student', 3, lambda w, rng: ('POST', '/favorite/%d' % rng.choice(w.ctx.courses), {}, None)),
+    Scenario('enroll_course', 'enroll_course', 'student', 2, lambda w, rng: ('POST', '/enroll/%d' % rng.choice(w.ctx.courses), {}, None)),
+    Scenario('enroll_cohort', 'enroll_cohort', 'admin', 1, lambda w, rng: ('POST', '/admin/course/%d/enrollments' % rng.choice(w.ctx.courses), None,
+                                                                           {'user_ids': [rng.randint(1, w.ctx.max_user_id) for _ in range(200)]})),
+    Scenario('learn', 'learn', 'student', 10, lambda w, rng: _get('/learn/%d' % rng.choice(w.student[1]))),
+    Scenario('progress_heartbeat', 'progress_heartbeat', 'student', 15, lambda w, rng: w.heartbeat(rng)),
+    Scenario('admin_courses', 'admin_courses', 'instructor', 3, lambda w, rng: _get('/admin/courses')),
+    Scenario('admin_courses_all', 'admin_courses', 'admin', 1, lambda w, rng: _get('/admin/courses')),
+    Scenario('create_course_form', 'create_course', 'instructor', 1, lambda w, rng: _get('/admin/course/create')),
+    Scenario('create_course', 'create_course', 'instructor', 1, lambda w, rng: ('POST', '/admin/course/create', _course_form(w.ctx, rng), None)),
+    Scenario('edit_course_form', 'edit_course', 'instructor', 1, lambda w, rng: _get('/admin/course/%d/edit' % rng.choice(w.ctx.instructor_courses))),
+    Scenario('edit_course', 'edit_course', 'instructor', 1, lambda w, rng: ('POST', '/admin/course/%d/edit' % rng.choice(w.ctx.instructor_courses), _course_form(w.ctx, rng, 'published'), None)),
+    Scenario('admin_report', 'admin_report', 'instructor', 1, lambda w, rng: _get('/admin/reports/%s?format=%s&course_id=%d' % (
+        rng.choice(('enrollments', 'progress', 'revenue')), rng.choice(('csv', 'jsonl')), rng.choice(w.ctx.instructor_courses)))),
+    Scenario('admin_report_all', 'admin_report', 'admin', 1, lambda w, rng: _get('/admin/reports/%s?course_id=%d' % (rng.choice(('enrollments', 'progress', 'revenue')), rng.choice(w.ctx.courses)))),
+    Scenario('delete_course', 'delete_course', 'admin', 1, lambda w, rng: ('POST', '/admin/course/%d/delete' % w.disposable_course(rng), {}, None)),
+    Scenario('demo_queries', 'demo_queries', 'anon', 1, lambda w, rng: _get('/demo/queries')),
+    Scenario('demo_query_timings', 'demo_query_timings', 'anon', 1, lambda w, rng: _get('/demo/queries/timings')),
+    Scenario('metrics', 'metrics', 'anon', 1, lambda w, rng: _get('/metrics')),
+]
+
+
+def _new_account(rng):
+    name = 'bench_%d_%d' % (os.getpid(), rng.randrange(10 ** 12))
+    return {'username': name, 'email': name + '@bench.example.com', 'password': PASSWORD, 'confirm_password': PASSWORD}
+
+
+def _course_form(ctx, rng, status='draft'):
+    return {'title': 'Bench course %d' % rng.randrange(10 ** 6), 'subtitle': 'Load test', 'description': 'Created by the load driver',
+            'category_id': rng.choice(ctx.categories), 'price': rng.choice((0, 99, 199)), 'level': 'beginner', 'status': status}
+
+
+class Context:
+    """从数据库中抽取压测要用到的真实 ID 与账号; 只读打开, 不经过应用"""
+
+    def __init__(self, database, seed):
+        rng = random.Random(seed)
+        self.database = os.path.abspath(database)
+        conn = sqlite3.connect('file:%s?mode=ro' % urllib.parse.quote(self.database), uri=True)
+        self.categories = [row[0] for row in conn.execute('SELECT category_id FROM category')]
+        self.max_user_id = conn.execute('SELECT MAX(user_id) FROM user').fetchone()[0] or 1
+        self.courses = self._sample(conn, rng, 'course', 'course_id', "SELECT course_id FROM course WHERE course_id IN (%s) AND status = 'published'")
+        students = defaultdict(list)
+        for email, course_id in self._sample(conn, rng, 'enrollment', 'enrollment_id', '''SELECT u.email, e.course_id FROM enrollment e
+                JOIN user u ON u.user_id = e.user_id WHERE e.enrollment_id IN (%s) AND u.status = 'active' '''):
+            students[email].append(course_id)
+        self.students = sorted(students.items())
+        self.lessons = {}
+        for course_id in {c for _, courses in self.students for c in courses}:
+            self.lessons[course_id] = conn.execute('''SELECT l.lesson_id, l.video_duration FROM chapter ch JOIN lesson l ON l.chapter_id = ch.chapter_id
+                WHERE ch.course_id = ?''', (course_id,)).fetchall()
+        row = conn.execute('''SELECT u.email, u.user_id FROM user u JOIN user_role ur ON ur.user_id = u.user_id AND ur.role_id = 2
+            WHERE u.status = 'active' AND EXISTS (SELECT 1 FROM course c WHERE c.instructor_id = u.user_id) LIMIT 1''').fetchone()
+        self.instructor = row[0] if row else None
+        self.instructor_courses = [r[0] for r in conn.execute('SELECT course_id FROM course WHERE instructor_id = ? LIMIT ?', (row[1] if row else None, SAMPLE_SIZE))]
+        row = conn.execute('''SELECT u.email FROM user u JOIN user_role ur ON ur.user_id = u.user_id AND ur.role_id = 3 WHERE u.status = 'active' LIMIT 1''').fetchone()
+        self.admin = row[0] if row else None
+        conn.close()
+        self.next_page_url = None
+
+    @staticmethod
+    def _sample(conn, rng, table, key, sql):
+        # 在主键范围内随机取 ID 再回表过滤, 避免 ORDER BY RANDOM() 扫描大表
+        high = conn.execute(f'SELECT MAX({key}) FROM "{table}"').fetchone()[0] or 0
+        ids = sorted({rng.randint(1, high) for _ in range(SAMPLE_SIZE)}) if high else []
+        return conn.execute(sql % ','.join('?' * len(ids)), ids).fetchall() if ids else []
+
+    def validate(self):
+        missing = [name for name, value in (('published courses', self.courses), ('students with enrollments', self.students),
+                                            ('an instructor owning courses', self.instructor), ('an admin', self.admin)) if not value]
+        if missing:
+            raise SystemExit('Database lacks %s; run python -m bench.datagen first' % ', '.join(missing))
+        self.courses = [row[0] for row in self.courses]
+
+    def course_by_title(self, title):
+        conn = sqlite3.connect('file:%s?mode=ro' % urllib.parse.quote(self.database), uri=True)
+        try:
+            row = conn.execute('SELECT MAX(course_id) FROM course WHERE title = ?', (title,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] or 0
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, form=None, json_body=None):
+        # 读完后关闭响应, 流式响应 (报表导出) 在关闭时才归还连接与并发名额
+        with self.client.open(path, method=method, data=form, json=json_body) as response:
+            return response.status_code, response.get_data()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpSession:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect)
+
+    def request(self, method, path, form=None, json_body=None):
+        data, headers = None, {}
+        if json_body is not None:
+            data, headers = json.dumps(json_body).encode(), {'Content-Type': 'application/json'}
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class Worker(threading.Thread):
+    def __init__(self, index, ctx, make_session, scenarios, deadline, max_requests, seed):
+        super().__init__(name='bench-worker-%d' % index, daemon=True)
+        self.ctx = ctx
+        self.rng = random.Random(seed * 1000 + index)
+        self.student = ctx.students[index % len(ctx.students)]
+        self.scenarios = scenarios
+        self.cum_weights = list(itertools.accumulate(s.weight for s in scenarios))
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sessions = {'anon': make_session()}
+        for persona, email in (('student', self.student[0]), ('instructor', ctx.instructor), ('admin', ctx.admin)):
+            session = self.sessions[persona] = make_session()
+            session.request('POST', '/login', {'email': email, 'password': PASSWORD})
+
+    def run(self):
+        done = 0
+        while time.perf_counter() < self.deadline and (not self.max_requests or done < self.max_requests):
+            scenario = self.rng.choices(self.scenarios, cum_weights=self.cum_weights)[0]
+            method, path, form, json_body = scenario.build(self, self.rng)
+            started = time.perf_counter()
+            try:
+                status, body = self.sessions[scenario.persona].request(method, path, form, json_body)
+            except Exception:
+                status, body = 599, b''
+            self.samples[scenario.name].append(time.perf_counter() - started)
+            if status >= 400:
+                self.errors[scenario.name] += 1
+            self._observe(scenario, status, body)
+            done += 1
+
+    def heartbeat(self, rng):
+        course_id = rng.choice(self.student[1])
+        lessons = self.ctx.lessons.get(course_id) or [(0, 0)]
+        events = [{'lesson_id': lesson_id, 'watched_duration': rng.randint(0, duration or 60)} for lesson_id, duration in rng.sample(lessons, min(3, len(lessons)))]
+        return 'POST', '/api/progress/heartbeat', None, {'course_id': course_id, 'events': events}
+
+    def disposable_course(self, rng):
+        """先 (不计时) 建一门草稿课程再删除它, 避免删掉抽样到的课程"""
+        form = _course_form(self.ctx, rng)
+        form['title'] = 'Disposable %s %d' % (self.name, rng.randrange(10 ** 12))
+        self.sessions['admin'].request('POST', '/admin/course/create', form)
+        return self.ctx.course_by_title(form['title'])
+
+    def _observe(self, scenario, status, body):
+        if scenario.name == 'courses' and status == 200 and self.ctx.next_page_url is None:
+            marker = body.find(b'cursor=')
+            if marker != -1:
+                start = body.rfind(b'"', 0, marker) + 1
+                self.ctx.next_page_url = body[start:body.find(b'"', marker)].decode().replace('&amp;', '&')
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+
+def summarize(workers, elapsed):
+    samples, errors = defaultdict(list), defaultdict(int)
+    for worker in workers:
+        for name, values in worker.samples.items():
+            samples[name].extend(values)
+        for name, count in worker.errors.items():
+            errors[name] += count
+    endpoints = {}
+    for name in sorted(samples):
+        values = sorted(samples[name])
+        endpoints[name] = {'requests': len(values), 'errors': errors[name], 'rps': round(len(values) / elapsed, 2),
+                           'mean_ms': round(1000 * sum(values) / len(values), 3),
+                           **{'p%d_ms' % p: round(1000 * percentile(values, p / 100), 3) for p in (50, 95, 99)}}
+    total = sum(e['requests'] for e in endpoints.values())
+    return endpoints, {'requests': total, 'errors': sum(errors.values()), 'rps': round(total / elapsed, 2)}
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """打印与基线的差异; 返回回归的 (场景, 指标) 列表"""
+    regressions = []
+    print('%-24s %22s %22s %22s %20s' % ('scenario', 'p50 ms', 'p95 ms', 'p99 ms', 'rps'))
+    for name, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(name)
+        if previous is None:
+            print('%-24s (new)' % name)
+            continue
+        cells = []
+        for metric, worse_if_higher in (('p50_ms', True), ('p95_ms', True), ('p99_ms', True), ('rps', False)):
+            before, after = previous[metric], current[metric]
+            change = (after - before) / before if before else 0.0
+            if (change if worse_if_higher else -change) > threshold:
+                regressions.append((name, metric))
+            cells.append('%9.2f -> %-9.2f%+.0f%%' % (before, after, 100 * change))
+        print('%-24s %s' % (name, ' '.join(cells)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Drive every route concurrently and report per-scenario latency percentiles')
+    parser.add_argument('--db', required=True, help='Database to sample IDs from (and to serve, without --url)')
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process test client')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to run')
+    parser.add_argument('--requests', type=int, default=0, help='Stop each worker after this many requests')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--only', help='Comma-separated scenario names')
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Baseline JSON report to diff against')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    ctx = Context(args.db, args.seed)
+    ctx.validate()
+    scenarios = [s for s in SCENARIOS if not args.only or s.name in args.only.split(',')]
+    if args.url:
+        make_session = lambda: HttpSession(args.url)
+    else:
+        os.environ['LEARNING_PLATFORM_DB'] = os.path.abspath(args.db)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import app
+        covered = {s.endpoint for s in SCENARIOS}
+        uncovered = sorted(r.endpoint for r in app.app.url_map.iter_rules() if r.endpoint != 'static' and r.endpoint not in covered)
+        if uncovered:
+            print('warning: no scenario for %s' % ', '.join(uncovered), file=sys.stderr)
+        make_session = lambda: TestClientSession(app.app)
+
+    # deadline 在所有 worker 登录完成后再确定
+    workers = [Worker(i, ctx, make_session, scenarios, float('inf'), args.requests, args.seed) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.deadline = started + args.duration
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    endpoints, totals = summarize(workers, elapsed)
+    report = {'meta': {'started_at': datetime.now().isoformat(timespec='seconds'), 'target': args.url or 'test-client', 'database': os.path.basename(args.db),
+                       'concurrency': args.concurrency, 'duration_s': round(elapsed, 2), 'seed': args.seed, 'python': platform.python_version(),
+                       'sqlite': sqlite3.sqlite_version}, 'totals': totals, 'endpoints': endpoints}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    print('%-24s %8s %6s %9s %9s %9s %9s' % ('scenario', 'requests', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, e in endpoints.items():
+        print('%-24s %8d %6d %9.1f %9.2f %9.2f %9.2f' % (name, e['requests'], e['errors'], e['rps'], e['p50_ms'], e['p95_ms'], e['p99_ms']))
+    print('%-24s %8d %6d %9.1f' % ('total', totals['requests'], totals['errors'], totals['rps']))
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print('%d regressions over %.0f%%: %s' % (len(regressions), 100 * args.threshold, ', '.join('%s %s' % r for r in regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
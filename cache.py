@@ -0,0 +1,207 @@
+"""
+进程内读穿缓存 (TTL + LRU), 可选共享后端用于多个 worker 之间共享数据与失效通知
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = 512
+CATALOG_CACHE_TTL = 60
+# 设置后启用文件共享后端, 同一台机器上的多个 worker 共享缓存
+CACHE_DIR = os.environ.get('LEARNING_PLATFORM_CACHE_DIR')
+# 多久检查一次共享后端的失效版本号 (秒)
+EPOCH_CHECK_INTERVAL = 1.0
+# 共享目录的容量上限; 每个 worker 每 CACHE_DIR_SWEEP_INTERVAL 秒在写入时清理一次过期文件, 超出上限时再按过期时间从早到晚淘汰
+CACHE_DIR_MAX_ENTRIES = 10000
+CACHE_DIR_MAX_BYTES = 256 * 1024 * 1024
+CACHE_DIR_SWEEP_INTERVAL = 60
+
+MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, default_ttl=CATALOG_CACHE_TTL):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, min_epoch=0):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, epoch, value = entry
+            if expires_at < time.monotonic() or epoch < min_epoch:
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, epoch=0):
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, epoch, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FileBackend:
+    """以目录为存储的共享后端; 值用 pickle 序列化, 写入用 rename 保证原子性. 文件的 mtime 设为过期时间, 清理时只需 stat"""
+
+    def __init__(self, directory, max_entries=CACHE_DIR_MAX_ENTRIES, max_bytes=CACHE_DIR_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._epoch_path = os.path.join(directory, 'epoch')
+        self._swept = 0.0
+        self._sweep_lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires_at, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+        return value if expires_at >= time.time() else MISSING
+
+    def set(self, key, value, ttl):
+        expires_at = time.time() + ttl
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires_at, value), f, pickle.HIGHEST_PROTOCOL)
+        os.utime(tmp, (expires_at, expires_at))
+        os.replace(tmp, self._path(key))
+        if time.monotonic() - self._swept >= CACHE_DIR_SWEEP_INTERVAL:
+            self.sweep()
+
+    def sweep(self):
+        """删除过期文件与中途崩溃留下的临时文件; 仍超出条目数或字节数上限时, 淘汰最早过期的条目. 返回删除的文件数"""
+        if not self._sweep_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._swept = time.monotonic()
+            now = time.time()
+            removed, entries = 0, []
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith('.pkl') and st.st_mtime >= now:
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                    elif entry.name.endswith('.pkl') or (entry.name.endswith('.tmp') and st.st_mtime < now - CACHE_DIR_SWEEP_INTERVAL):
+                        removed += self._remove(entry.path)
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries[:max(0, len(entries) - self.max_entries)]:
+                removed += self._remove(path)
+                total -= size
+            for _, size, path in entries[max(0, len(entries) - self.max_entries):]:
+                if total <= self.max_bytes:
+                    break
+                removed += self._remove(path)
+                total -= size
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def epoch(self):
+        try:
+            return os.stat(self._epoch_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump_epoch(self):
+        with open(self._epoch_path, 'a'):
+            pass
+        now = time.time_ns()
+        os.utime(self._epoch_path, ns=(now, max(now, self.epoch() + 1)))
+
+
+class ReadThroughCache:
+    """get_or_load: 先查本地 LRU, 再查共享后端, 都未命中时调用 loader 并回填"""
+
+    def __init__(self, local, backend=None):
+        self.local = local
+        self.backend = backend
+        self._epoch = 0
+        self._epoch_checked = 0.0
+
+    def _current_epoch(self):
+        # 其他 worker 失效缓存时会推进共享版本号, 本地早于该版本的条目全部作废
+        if self.backend is None:
+            return 0
+        now = time.monotonic()
+        if now - self._epoch_checked >= EPOCH_CHECK_INTERVAL:
+            self._epoch = self.backend.epoch()
+            self._epoch_checked = now
+        return self._epoch
+
+    def get_or_load(self, key, loader, ttl=None):
+        epoch = self._current_epoch()
+        value = self.local.get(key, epoch)
+        if value is not MISSING:
+            return value
+        ttl = self.local.default_ttl if ttl is None else ttl
+        if self.backend is not None:
+            value = self.backend.get(key)
+        if value is MISSING:
+            value = loader()
+            if self.backend is not None:
+                self.backend.set(key, value, ttl)
+        self.local.set(key, value, ttl, epoch)
+        return value
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self.local.delete(key)
+            if self.backend is not None:
+                self.backend.delete(key)
+        if self.backend is not None:
+            self.backend.bump_epoch()
+            self._epoch_checked = 0.0
+
+    def clear(self):
+        self.local.clear()
+        if self.backend is not None:
+            self.backend.bump_epoch()
+            self._epoch_checked = 0.0
+
+
+catalog = ReadThroughCache(LRUCache(), FileBackend(CACHE_DIR) if CACHE_DIR else None)
@@ -0,0 +1,159 @@
+"""
+查询计划回归检查 - 对应用中的每条 SQL 执行 EXPLAIN QUERY PLAN, 大表出现全表 SCAN 时失败;
+遍历路由时任何请求返回 5xx (包括被篡改的分页游标) 同样视为失败
+
+用法: python check_query_plans.py [-v]
+"""
+import ast
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCES = ['app.py', 'curriculum.py', 'enrollments.py', 'progress.py', 'reports.py']
+# 小表 (角色/分类字典) 全表扫描可以接受
+LARGE_TABLES = {'user', 'user_profile', 'user_role', 'course', 'chapter', 'lesson', 'order', 'order_item', 'enrollment', 'learning_progress', 'review', 'favorite', 'cart'}
+# 分析型查询与管理员的全量导出本身就需要扫描整表
+ALLOWED_SCAN_ORIGINS = {'demo_queries', 'demo_query_timings', 'analytics-snapshot', 'report-all'}
+# 报表 SQL 的 WHERE 条件在运行时拼接: (来源, 条件)
+REPORT_SCOPES = [('report-instructor', 'c.instructor_id = ?'), ('report-course', 'c.course_id = ?'),
+                 ('report-instructor-course', 'c.instructor_id = ? AND c.course_id = ?'), ('report-all', '1')]
+PERSONAS = [None, ('john@example.com', 'password123'), ('wang@example.com', 'password123'), ('admin@example.com', 'password123')]
+EXTRA_REQUESTS = ['/courses?sort=%s' % s for s in ('popular', 'rating', 'price_low', 'price_high', 'newest')] + [
+    '/courses?category=1&level=beginner&keyword=python', '/learn/1?lesson=1']
+# 被篡改的分页游标 (值无法绑定为 SQL 参数), 应按第一页处理而不是返回 500: (排序, 值, 主键)
+TAMPERED_CURSORS = [('newest', [1], 1), ('newest', {'a': 1}, 1), ('newest', 2 ** 70, 1), ('newest', 'x', True), ('created', None, -2 ** 64)]
+
+PLAN_SCAN = re.compile(r'^SCAN (\S+)(?: USING (?:COVERING )?INDEX .*)?$')
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|LEFT\b|INNER\b|JOIN\b|GROUP\b|ORDER\b|LIMIT\b|USING\b)(\w+))?', re.I)
+# 不带筛选条件的近似总数 (pagination.paginate) 最多读 APPROX_TOTAL_CAP + 1 行, 扫描代价有上限
+BOUNDED_COUNT = re.compile(r'^SELECT COUNT\(\*\) FROM \(SELECT 1 FROM .* WHERE 1 LIMIT (?:\?|\d+)\)$', re.I)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE', 'WITH')
+
+
+def static_statements(path):
+    """从源码中提取所有以字符串字面量传入 execute/executemany 的 SQL"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    found = []
+    for func in ast.walk(tree):
+        if not isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        for node in ast.walk(func):
+            if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in ('execute', 'executemany')
+                    and node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+                found.append((func.name, node.args[0].value))
+    return found
+
+
+def report_statements(reports_module):
+    """报表模板按每种权限范围展开; 流式响应在请求上下文之外执行, 测试客户端访问时不会被记录"""
+    return [(origin, sql.format(where=where)) for sql in reports_module.REPORTS.values() for origin, where in REPORT_SCOPES]
+
+
+def traced_statements(app_module, db_module):
+    """通过测试客户端以各种身份访问所有路由, 记录实际执行的 SQL (覆盖动态拼接的查询); 同时返回出现 5xx 的请求"""
+    from flask import has_request_context, request
+    import pagination
+    found, errors = [], []
+
+    def trace(conn):
+        conn.set_trace_callback(lambda sql: found.append((request.endpoint if has_request_context() else threading.current_thread().name, sql)))
+    db_module.on_connect(trace)
+    db_module.pool.close_all()
+    app = app_module.app
+    urls = list(EXTRA_REQUESTS)
+    for sort, value, key in TAMPERED_CURSORS:
+        token = pagination.encode_cursor(sort, value, key)
+        urls += ['/courses?sort=%s&cursor=%s' % (sort, token), '/admin/courses?cursor=%s' % token]
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static' or any(rule._converters[a].__class__.__name__ != 'IntegerConverter' for a in rule.arguments):
+            continue
+        urls.append((rule, app.url_map.bind('localhost').build(rule.endpoint, {a: 1 for a in rule.arguments})))
+    for persona in PERSONAS:
+        client = app.test_client()
+        if persona:
+            client.post('/login', data={'email': persona[0], 'password': persona[1]})
+        for item in urls:
+            if isinstance(item, str):
+                responses = [(item, client.get(item))]
+            else:
+                rule, url = item
+                responses = []
+                if 'GET' in rule.methods and rule.endpoint != 'logout':
+                    responses.append((url, client.get(url)))
+                if 'POST' in rule.methods and rule.endpoint not in ('login', 'logout'):
+                    responses.append(('POST ' + url, client.post(url, data={})))
+            for url, response in responses:
+                if response.status_code >= 500:
+                    errors.append((persona[0] if persona else 'anonymous', url, response.status_code))
+                response.close()
+    return found, errors
+
+
+def resolve_aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table.lower()] = table.lower()
+        if alias:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def check(conn, statements, verbose=False):
+    failures, seen = [], set()
+    for origin, sql in statements:
+        normalized = ' '.join(sql.split())
+        if normalized in seen or not normalized.upper().startswith(EXPLAINABLE):
+            continue
+        seen.add(normalized)
+        params = [None] * normalized.count('?')
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + normalized, params)]
+        aliases = resolve_aliases(normalized)
+        scans = []
+        for detail in plan:
+            m = PLAN_SCAN.match(detail)
+            if m and 'USING' not in detail and aliases.get(m.group(1).lower(), m.group(1).lower()) in LARGE_TABLES:
+                scans.append(detail)
+        if scans and origin not in ALLOWED_SCAN_ORIGINS and not BOUNDED_COUNT.match(normalized):
+            failures.append((origin, normalized, plan))
+        if verbose:
+            print('[%s] %s\n    %s' % (origin, normalized[:120], '\n    '.join(plan) or '(no plan)'))
+    return failures, len(seen)
+
+
+def main(argv):
+    verbose = '-v' in argv
+    workdir = tempfile.mkdtemp()
+    os.environ['LEARNING_PLATFORM_DB'] = os.path.join(workdir, 'plan_check.db')
+    sys.path.insert(0, BASE_DIR)
+    try:
+        import app as app_module
+        import db as db_module
+        import reports as reports_module
+        app_module.seed_sample_data()
+        statements = []
+        for source in SOURCES:
+            statements.extend(static_statements(os.path.join(BASE_DIR, source)))
+        statements.extend(report_statements(reports_module))
+        traced, errors = traced_statements(app_module, db_module)
+        statements.extend(traced)
+        conn = db_module.connect()
+        failures, total = check(conn, statements, verbose)
+        conn.close()
+        db_module.pool.close_all()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for origin, sql, plan in failures:
+        print('FULL SCAN in %s:\n  %s\n    %s' % (origin, sql, '\n    '.join(plan)))
+    for persona, url, status in errors:
+        print('HTTP %d for %s as %s' % (status, url, persona))
+    print('%d statements checked, %d regressions, %d server errors' % (total, len(failures), len(errors)))
+    return 1 if failures or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
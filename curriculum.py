@@ -0,0 +1,72 @@
+"""
+课程大纲 - 一次查询加载课程的全部章节与课时, 以不可变结构按课程缓存
+
+course_detail 与 learn 共用同一份大纲; 课程内容变化时调用 invalidate(course_id)
+"""
+import zlib
+from collections import namedtuple
+
+import cache
+
+OUTLINE_CACHE_TTL = 300
+OUTLINE_CACHE_ENTRIES = 1024
+
+Lesson = namedtuple('Lesson', 'lesson_id chapter_id title content_type video_url video_duration sort_order is_free position')
+Chapter = namedtuple('Chapter', 'chapter_id title description sort_order is_free lessons')
+
+
+class Outline:
+    """一门课程的大纲; position 是课时在整门课程中的顺序号 (从 0 开始), layout 是课时顺序的校验值"""
+    __slots__ = ('course_id', 'chapters', 'lessons', 'positions', 'layout')
+
+    def __init__(self, course_id, chapters):
+        self.course_id = course_id
+        self.chapters = chapters
+        self.lessons = tuple(lesson for chapter in chapters for lesson in chapter.lessons)
+        self.positions = {lesson.lesson_id: lesson.position for lesson in self.lessons}
+        # 按位置存储的数据 (如 progress.py 的进度位图) 用它判断课时增删或调整顺序后是否需要重建
+        self.layout = zlib.crc32(','.join(str(lesson.lesson_id) for lesson in self.lessons).encode())
+
+    def __getstate__(self):
+        return self.course_id, self.chapters
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @property
+    def lesson_count(self):
+        return len(self.lessons)
+
+    def lesson(self, lesson_id):
+        position = self.positions.get(lesson_id)
+        return None if position is None else self.lessons[position]
+
+
+_outlines = cache.ReadThroughCache(cache.LRUCache(OUTLINE_CACHE_ENTRIES, OUTLINE_CACHE_TTL), cache.catalog.backend)
+
+
+def load_outline(conn, course_id):
+    rows = conn.execute('''SELECT ch.chapter_id, ch.title as chapter_title, ch.description as chapter_description, ch.sort_order as chapter_order, ch.is_free as chapter_free,
+        l.lesson_id, l.title as lesson_title, l.content_type, l.video_url, l.video_duration, l.sort_order as lesson_order, l.is_free as lesson_free
+        FROM chapter ch LEFT JOIN lesson l ON ch.chapter_id = l.chapter_id WHERE ch.course_id = ?
+        ORDER BY ch.sort_order, ch.chapter_id, l.sort_order, l.lesson_id''', (course_id,))
+    chapters, current, lessons, position = [], None, [], 0
+    for row in rows:
+        if current is None or row['chapter_id'] != current['chapter_id']:
+            if current is not None:
+                chapters.append(Chapter(current['chapter_id'], current['chapter_title'], current['chapter_description'], current['chapter_order'], current['chapter_free'], tuple(lessons)))
+            current, lessons = row, []
+        if row['lesson_id'] is not None:
+            lessons.append(Lesson(row['lesson_id'], row['chapter_id'], row['lesson_title'], row['content_type'], row['video_url'], row['video_duration'], row['lesson_order'], row['lesson_free'], position))
+            position += 1
+    if current is not None:
+        chapters.append(Chapter(current['chapter_id'], current['chapter_title'], current['chapter_description'], current['chapter_order'], current['chapter_free'], tuple(lessons)))
+    return Outline(course_id, tuple(chapters))
+
+
+def get_outline(conn, course_id):
+    return _outlines.get_or_load('outline:%d' % course_id, lambda: load_outline(conn, course_id))
+
+
+def invalidate(course_id):
+    _outlines.invalidate('outline:%d' % course_id)
@@ -0,0 +1,245 @@
+"""
+数据库访问 - 读写分离
+
+读: 只读连接池 (PRAGMA query_only), 每个连接只在创建时执行一次 PRAGMA 调优, 请求结束时归还
+写: 所有写操作提交给唯一的写线程排队执行, 同一批的多个小写入合并为一次提交 (group commit), 调用方拿到 Future
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+from flask import g
+
+DATABASE = os.environ.get('LEARNING_PLATFORM_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'learning_platform.db'))
+POOL_SIZE = int(os.environ.get('LEARNING_PLATFORM_DB_POOL', 8))
+BUSY_TIMEOUT_MS = 5000
+# 一次提交最多合并的写操作数, 以及收到第一个写操作后再等待后续写操作的时间
+WRITE_BATCH_SIZE = 200
+WRITE_BATCH_WINDOW = 0.002
+# 等待写操作结果的上限 (秒); 写线程出故障时请求报错而不是一直挂起
+WRITE_TIMEOUT = 30
+
+# WAL 让读者与写者互不阻塞; NORMAL 在 WAL 下仍保证崩溃一致性
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', BUSY_TIMEOUT_MS),
+    ('cache_size', -16000),
+    ('mmap_size', 268435456),
+    ('temp_store', 'MEMORY'),
+)
+
+
+# 连接类, metrics.init_app() 会替换为带统计的子类
+connection_factory = sqlite3.Connection
+_connect_hooks = []
+
+logger = logging.getLogger(__name__)
+
+
+def on_connect(fn):
+    """注册一个在每个新连接建立后调用的钩子 (用于跟踪/监控)"""
+    _connect_hooks.append(fn)
+    return fn
+
+
+def connect(database=None, readonly=False):
+    conn = sqlite3.connect(database or DATABASE, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, factory=connection_factory)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS:
+        # journal_mode 是持久化在库文件里的, 只读连接不需要 (也不能) 再设置
+        if not (readonly and name == 'journal_mode'):
+            conn.execute(f'PRAGMA {name} = {value}')
+    if readonly:
+        conn.execute('PRAGMA query_only = 1')
+    for hook in _connect_hooks:
+        hook(conn)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, database=None, size=POOL_SIZE, readonly=True):
+        self.database = database
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        # gunicorn 等预分叉服务器中, 父进程的连接不能在子进程复用
+        with self._lock:
+            if self._pid != os.getpid():
+                self._idle = queue.LifoQueue()
+                self._pid = os.getpid()
+
+    def acquire(self):
+        self._reset_after_fork()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.database, self.readonly)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._pid != os.getpid() or self._idle.qsize() >= self.size:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class Rollback(Exception):
+    """写操作中抛出: 撤销该操作已做的修改, 但不算失败, Future 的结果为 result"""
+
+    def __init__(self, result=None):
+        super().__init__(result)
+        self.result = result
+
+
+class Writer:
+    """单写线程. 提交的写操作 fn(conn, *args) 在同一个 BEGIN IMMEDIATE 事务中依次执行, 每个操作各占一个 SAVEPOINT,
+    一个操作失败只回滚它自己; 整批提交成功后才设置各 Future 的结果"""
+
+    def __init__(self, database=None, batch_size=WRITE_BATCH_SIZE, window=WRITE_BATCH_WINDOW):
+        self.database = database
+        self.batch_size = batch_size
+        self.window = window
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((fn, args, future))
+        return future
+
+    def call(self, fn, *args, timeout=WRITE_TIMEOUT):
+        """提交并等待结果; 超时抛出 concurrent.futures.TimeoutError"""
+        return self.submit(fn, *args).result(timeout)
+
+    def execute(self, sql, parameters=()):
+        """单条语句的写操作; Future 的结果为影响行数"""
+        return self.submit(lambda conn: conn.execute(sql, parameters).rowcount)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = None
+            # 写线程异常退出 (或已 stop) 后, 下一次提交时重新启动
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self._queue.get(timeout=self.window))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        batch = []
+        try:
+            conn = connect(self.database)
+            conn.isolation_level = None
+            while True:
+                batch = self._next_batch()
+                if batch[-1] is None:
+                    batch.pop()
+                    self._write(conn, batch)
+                    conn.close()
+                    return
+                self._write(conn, batch)
+                batch = []
+        except BaseException as e:
+            logger.exception('Writer thread died')
+            self._fail_pending(batch, e)
+
+    def _fail_pending(self, batch, error):
+        # 当前批次与队列中尚未执行的写操作全部以该异常结束; 持有锁, 新线程要等清理完成后才会启动
+        with self._lock:
+            while True:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    batch.append(job)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+    def _write(self, conn, batch):
+        batch = [job for job in batch if job[2].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, args, _ in batch:
+                conn.execute('SAVEPOINT job')
+                try:
+                    results.append((True, fn(conn, *args)))
+                    conn.execute('RELEASE job')
+                except Exception as e:
+                    conn.execute('ROLLBACK TO job')
+                    conn.execute('RELEASE job')
+                    results.append((True, e.result) if isinstance(e, Rollback) else (False, e))
+            conn.execute('COMMIT')
+        except Exception as e:
+            logger.exception('Group commit of %d writes failed', len(batch))
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(False, e)] * len(batch)
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+pool = ConnectionPool()
+writer = Writer()
+atexit.register(writer.stop)
+
+
+def get_db():
+    """当前请求的只读连接; 写操作经 writer 提交"""
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return g.db
+
+
+def close_db(exc=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        pool.release(conn)
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
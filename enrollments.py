@@ -0,0 +1,60 @@
+"""
+选课下单 - 订单、订单明细与选课记录作为一个写操作提交给 db.writer, 在其 BEGIN IMMEDIATE 事务中原子写入
+
+单个学员选课用 ON CONFLICT 处理重复选课 (重复时回滚整个操作, 不留下孤立订单); 整批学员 (企业开通) 用
+executemany 一次写入. 课时总数取自已缓存的课程大纲, 不再每次联表计数
+"""
+import json
+import secrets
+from datetime import datetime
+
+from db import Rollback
+
+ENROLLED = 'enrolled'
+ALREADY_ENROLLED = 'already_enrolled'
+COURSE_NOT_FOUND = 'course_not_found'
+MAX_COHORT_SIZE = 10000
+
+
+def order_number(user_id, now):
+    # 微秒时间戳 + 随机后缀: 同一用户同一秒内的多次下单也不会撞上 UNIQUE 约束
+    return f"ORD{now.strftime('%Y%m%d%H%M%S%f')}{user_id:04d}{secrets.token_hex(3).upper()}"
+
+
+def enroll(conn, user_id, course_id, total_lessons, payment_method=None):
+    """写操作: 为单个学员选课; 返回 ENROLLED / ALREADY_ENROLLED / COURSE_NOT_FOUND"""
+    now = datetime.now()
+    c = conn.execute('''INSERT INTO "order" (order_no, user_id, total_amount, final_amount, payment_method, payment_status, paid_at)
+        SELECT ?, ?, price, price, COALESCE(?, CASE WHEN price = 0 THEN 'free' ELSE 'alipay' END), 'paid', ? FROM course WHERE course_id = ?''',
+                     (order_number(user_id, now), user_id, payment_method, now, course_id))
+    if c.rowcount == 0:
+        return COURSE_NOT_FOUND
+    order_id = c.lastrowid
+    conn.execute('INSERT INTO order_item (order_id, course_id, price) SELECT ?, course_id, price FROM course WHERE course_id = ?', (order_id, course_id))
+    c = conn.execute('INSERT INTO enrollment (user_id, course_id, order_id, total_lessons) VALUES (?, ?, ?, ?) ON CONFLICT (user_id, course_id) DO NOTHING',
+                     (user_id, course_id, order_id, total_lessons))
+    if c.rowcount == 0:
+        raise Rollback(ALREADY_ENROLLED)
+    return ENROLLED
+
+
+def enroll_cohort(conn, course_id, user_ids, total_lessons, payment_method='corporate'):
+    """写操作: 整批选课; 不存在的用户与已选过该课的用户被跳过. 返回 (新选课人数, 跳过人数), 课程不存在时返回 None"""
+    requested = list(dict.fromkeys(user_ids))
+    now = datetime.now()
+    course = conn.execute('SELECT price FROM course WHERE course_id = ?', (course_id,)).fetchone()
+    if course is None:
+        return None
+    price = course['price']
+    new_users = [row[0] for row in conn.execute('''SELECT u.user_id FROM json_each(?) j JOIN user u ON u.user_id = j.value
+        WHERE NOT EXISTS (SELECT 1 FROM enrollment e WHERE e.user_id = u.user_id AND e.course_id = ?)''', (json.dumps(requested), course_id))]
+    # 写线程持有写锁, 可以按 AUTOINCREMENT 序列预分配订单号, 三张表都直接 executemany
+    first_order = conn.execute('''SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'order'), 0),
+        COALESCE((SELECT MAX(order_id) FROM "order"), 0)) + 1''').fetchone()[0]
+    orders = list(zip(range(first_order, first_order + len(new_users)), new_users))
+    conn.executemany('INSERT INTO "order" (order_id, order_no, user_id, total_amount, final_amount, payment_method, payment_status, paid_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                     [(order_id, order_number(user_id, now), user_id, price, price, payment_method, 'paid', now) for order_id, user_id in orders])
+    conn.executemany('INSERT INTO order_item (order_id, course_id, price) VALUES (?, ?, ?)', [(order_id, course_id, price) for order_id, _ in orders])
+    conn.executemany('INSERT INTO enrollment (user_id, course_id, order_id, total_lessons, enrolled_at) VALUES (?, ?, ?, ?, ?)',
+                     [(user_id, course_id, order_id, total_lessons, now) for order_id, user_id in orders])
+    return len(new_users), len(requested) - len(new_users)
@@ -0,0 +1,163 @@
+"""
+SQL 监控 - 包装 get_db() 返回连接上的游标, 统计每个请求/路由的语句数与 SQL 耗时
+
+超过阈值的语句连同 EXPLAIN QUERY PLAN 写入慢查询日志; /metrics 以 Prometheus 文本格式输出
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import Response, g, has_request_context, request
+
+import db
+
+SLOW_QUERY_MS = float(os.environ.get('LEARNING_PLATFORM_SLOW_QUERY_MS', 100))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'REPLACE', 'WITH')
+
+slow_log = logging.getLogger('slow_query')
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries_per_request = defaultdict(lambda: Histogram(QUERY_COUNT_BUCKETS))
+        self.requests = defaultdict(int)
+        self.sql_queries = defaultdict(int)
+        self.sql_seconds = defaultdict(float)
+        self.slow_queries = defaultdict(int)
+
+    def observe_request(self, endpoint, method, status, seconds, sql_count, sql_seconds):
+        with self._lock:
+            self.latency[endpoint].observe(seconds)
+            self.queries_per_request[endpoint].observe(sql_count)
+            self.requests[(endpoint, method, status)] += 1
+            self.sql_queries[endpoint] += sql_count
+            self.sql_seconds[endpoint] += sql_seconds
+
+    def observe_slow_query(self, endpoint):
+        with self._lock:
+            self.slow_queries[endpoint] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            _histogram(lines, 'http_request_duration_seconds', 'Request latency by endpoint', self.latency)
+            _histogram(lines, 'sql_queries_per_request', 'SQL statements issued per request', self.queries_per_request)
+            lines += ['# HELP http_requests_total Requests by endpoint, method and status', '# TYPE http_requests_total counter']
+            lines += ['http_requests_total{endpoint="%s",method="%s",status="%s"} %d' % (e, m, s, n) for (e, m, s), n in sorted(self.requests.items())]
+            _counter(lines, 'sql_queries_total', 'SQL statements issued by endpoint', self.sql_queries)
+            _counter(lines, 'sql_duration_seconds_total', 'Time spent executing SQL by endpoint', self.sql_seconds)
+            _counter(lines, 'sql_slow_queries_total', 'Statements slower than the slow-query threshold', self.slow_queries)
+        return '\n'.join(lines) + '\n'
+
+
+def _counter(lines, name, help_text, values):
+    lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s counter' % name]
+    lines += ['%s{endpoint="%s"} %s' % (name, endpoint, value) for endpoint, value in sorted(values.items())]
+
+
+def _histogram(lines, name, help_text, histograms):
+    lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+    for endpoint, hist in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (name, endpoint, bound, cumulative))
+        lines.append('%s_bucket{endpoint="%s",le="+Inf"} %d' % (name, endpoint, hist.total))
+        lines.append('%s_sum{endpoint="%s"} %s' % (name, endpoint, hist.sum))
+        lines.append('%s_count{endpoint="%s"} %d' % (name, endpoint, hist.total))
+
+
+registry = Registry()
+
+
+def _endpoint():
+    return (request.endpoint or 'unknown') if has_request_context() else threading.current_thread().name
+
+
+def _record(conn, sql, parameters, seconds):
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        endpoint = _endpoint()
+        registry.observe_slow_query(endpoint)
+        plan = []
+        if parameters is not None and sql.lstrip().upper().startswith(EXPLAINABLE):
+            try:
+                plan = [row[3] for row in sqlite3.Cursor(conn).execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+            except sqlite3.Error:
+                pass
+        slow_log.warning('%.1f ms [%s] %s\n    %s', seconds * 1000, endpoint, ' '.join(sql.split()), '\n    '.join(plan))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record(self.connection, sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record(self.connection, sql, None, time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+def _observe(response):
+    seconds = time.perf_counter() - g.pop('request_started', time.perf_counter())
+    sql_count, sql_seconds = g.get('sql_count', 0), g.get('sql_seconds', 0.0)
+    registry.observe_request(request.endpoint or 'unknown', request.method, response.status_code, seconds, sql_count, sql_seconds)
+    response.headers['Server-Timing'] = 'db;dur=%.2f;desc="%d queries", app;dur=%.2f' % (sql_seconds * 1000, sql_count, seconds * 1000)
+    return response
+
+
+def metrics_view():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    db.connection_factory = InstrumentedConnection
+    app.before_request(_start_timer)
+    app.after_request(_observe)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
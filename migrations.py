@@ -0,0 +1,145 @@
+"""
+数据库结构迁移 - 以 PRAGMA user_version 记录当前结构版本
+
+MIGRATIONS 按版本号升序排列, 每个迁移在一个 BEGIN IMMEDIATE 事务中执行并同时写入新的 user_version, 失败时整体回滚;
+多个进程同时启动时, 拿到写锁后会重新检查版本号, 每个迁移只执行一次. 结构已是最新时启动只读取一次 user_version.
+版本 1 是引入迁移之前的全部结构 (均为 IF NOT EXISTS, 已有数据库可以直接升级); 其中包含各模块的 SCHEMA,
+之后对任何表/索引/触发器的修改都要追加新的迁移, 而不是修改已发布的迁移
+"""
+import logging
+import sqlite3
+
+import aggregates
+import authz
+import progress
+import recommend
+import search
+import taxonomy
+import versions
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT = 30
+
+CORE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS user (user_id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL UNIQUE, email TEXT NOT NULL UNIQUE, password_hash TEXT NOT NULL, phone TEXT, status TEXT DEFAULT 'active', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_login DATETIME);
+    CREATE TABLE IF NOT EXISTS user_profile (profile_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL UNIQUE, avatar_url TEXT, bio TEXT, gender TEXT, location TEXT, occupation TEXT, FOREIGN KEY (user_id) REFERENCES user(user_id));
+    CREATE TABLE IF NOT EXISTS role (role_id INTEGER PRIMARY KEY AUTOINCREMENT, role_name TEXT NOT NULL UNIQUE, description TEXT);
+    CREATE TABLE IF NOT EXISTS user_role (user_id INTEGER NOT NULL, role_id INTEGER NOT NULL, PRIMARY KEY (user_id, role_id));
+    CREATE TABLE IF NOT EXISTS category (category_id INTEGER PRIMARY KEY AUTOINCREMENT, category_name TEXT NOT NULL, parent_id INTEGER, description TEXT, sort_order INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS course (course_id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, subtitle TEXT, description TEXT, instructor_id INTEGER NOT NULL, category_id INTEGER, cover_image TEXT, price REAL DEFAULT 0.00, original_price REAL, level TEXT DEFAULT 'beginner', duration_hours REAL DEFAULT 0, status TEXT DEFAULT 'draft', is_featured INTEGER DEFAULT 0, enrollment_count INTEGER DEFAULT 0, rating_avg REAL DEFAULT 0.00, rating_count INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, published_at DATETIME);
+    CREATE TABLE IF NOT EXISTS chapter (chapter_id INTEGER PRIMARY KEY AUTOINCREMENT, course_id INTEGER NOT NULL, title TEXT NOT NULL, description TEXT, sort_order INTEGER DEFAULT 0, is_free INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS lesson (lesson_id INTEGER PRIMARY KEY AUTOINCREMENT, chapter_id INTEGER NOT NULL, title TEXT NOT NULL, content_type TEXT DEFAULT 'video', video_url TEXT, video_duration INTEGER DEFAULT 0, sort_order INTEGER DEFAULT 0, is_free INTEGER DEFAULT 0);
+    CREATE TABLE IF NOT EXISTS "order" (order_id INTEGER PRIMARY KEY AUTOINCREMENT, order_no TEXT NOT NULL UNIQUE, user_id INTEGER NOT NULL, total_amount REAL NOT NULL, discount_amount REAL DEFAULT 0.00, final_amount REAL NOT NULL, payment_method TEXT DEFAULT 'alipay', payment_status TEXT DEFAULT 'pending', paid_at DATETIME, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE IF NOT EXISTS order_item (item_id INTEGER PRIMARY KEY AUTOINCREMENT, order_id INTEGER NOT NULL, course_id INTEGER NOT NULL, price REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS enrollment (enrollment_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, order_id INTEGER, progress_percent REAL DEFAULT 0.00, completed_lessons INTEGER DEFAULT 0, total_lessons INTEGER DEFAULT 0, status TEXT DEFAULT 'active', enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_accessed_at DATETIME, UNIQUE (user_id, course_id));
+    CREATE TABLE IF NOT EXISTS learning_progress (progress_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, lesson_id INTEGER NOT NULL, watched_duration INTEGER DEFAULT 0, progress_percent REAL DEFAULT 0.00, is_completed INTEGER DEFAULT 0, UNIQUE (user_id, lesson_id));
+    CREATE TABLE IF NOT EXISTS review (review_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, rating INTEGER NOT NULL, content TEXT, helpful_count INTEGER DEFAULT 0, status TEXT DEFAULT 'approved', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
+    CREATE TABLE IF NOT EXISTS favorite (favorite_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
+    CREATE TABLE IF NOT EXISTS cart (cart_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, course_id INTEGER NOT NULL, added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, UNIQUE (user_id, course_id));
+    -- 二级索引: 对应 sql/database_schema.sql 中的 INDEX, 并按实际查询补充复合/覆盖索引
+    CREATE INDEX IF NOT EXISTS idx_user_status ON user (status);
+    CREATE INDEX IF NOT EXISTS idx_category_parent ON category (parent_id, sort_order);
+    CREATE INDEX IF NOT EXISTS idx_course_instructor ON course (instructor_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_course_category ON course (category_id, status);
+    CREATE INDEX IF NOT EXISTS idx_course_created ON course (created_at);
+    CREATE INDEX IF NOT EXISTS idx_course_featured ON course (status, is_featured, enrollment_count);
+    CREATE INDEX IF NOT EXISTS idx_course_status_created ON course (status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_course_status_published ON course (status, published_at);
+    CREATE INDEX IF NOT EXISTS idx_course_status_enrollment ON course (status, enrollment_count);
+    CREATE INDEX IF NOT EXISTS idx_course_status_rating ON course (status, rating_avg);
+    CREATE INDEX IF NOT EXISTS idx_course_status_price ON course (status, price);
+    CREATE INDEX IF NOT EXISTS idx_chapter_course ON chapter (course_id, sort_order);
+    CREATE INDEX IF NOT EXISTS idx_lesson_chapter ON lesson (chapter_id, sort_order);
+    CREATE INDEX IF NOT EXISTS idx_order_user ON "order" (user_id);
+    CREATE INDEX IF NOT EXISTS idx_order_status_created ON "order" (payment_status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_order_item_order ON order_item (order_id);
+    CREATE INDEX IF NOT EXISTS idx_order_item_course ON order_item (course_id);
+    CREATE INDEX IF NOT EXISTS idx_enrollment_course ON enrollment (course_id, status);
+    CREATE INDEX IF NOT EXISTS idx_progress_lesson ON learning_progress (lesson_id);
+    CREATE INDEX IF NOT EXISTS idx_review_course ON review (course_id, status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_review_rating ON review (rating);
+    CREATE INDEX IF NOT EXISTS idx_favorite_course ON favorite (course_id);
+    CREATE INDEX IF NOT EXISTS idx_cart_user ON cart (user_id);
+'''
+
+# 参考数据: 注册流程与权限检查依赖这三个角色
+ROLES = '''
+    INSERT OR IGNORE INTO role (role_name, description) VALUES ('student', 'Student'), ('instructor', 'Instructor'), ('admin', 'Administrator');
+'''
+
+
+def _build_derived(conn):
+    # 触发器只维护之后的增量, 已有数据由这里补齐; course 上的汇总列也按实际的选课与评价修正, 之后的增量才有正确的起点
+    aggregates.rebuild_stats(conn)
+    aggregates.repair_drift(conn)
+    if not search.is_indexed(conn):
+        search.rebuild(conn)
+    if not taxonomy.is_built(conn):
+        taxonomy.rebuild(conn)
+
+
+# (版本号, 说明, 步骤): 步骤为 SQL 脚本或以连接为参数的函数, 按顺序在同一事务中执行
+MIGRATIONS = [
+    (1, 'baseline schema', (CORE_SCHEMA, search.SCHEMA, aggregates.SCHEMA, taxonomy.SCHEMA, recommend.SCHEMA, versions.SCHEMA, progress.SCHEMA, ROLES, _build_derived)),
+    (2, 'authorization versions', (authz.SCHEMA,)),
+    # 旧的删除触发器会留下原祖先到孙分类的闭包行; 重建触发器后由 rebuild() 清理已有的残留
+    (3, 'category delete closure', ('DROP TRIGGER IF EXISTS category_closure_ad;', taxonomy.SCHEMA, taxonomy.rebuild)),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def _statements(script):
+    # executescript() 会先提交当前事务, 这里按完整语句拆开逐条执行 (触发器体内的分号不会被拆开)
+    statement = ''
+    for part in script.split(';'):
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            if statement.strip(' \t\n;'):
+                yield statement
+            statement = ''
+
+
+def _apply(conn, steps):
+    for step in steps:
+        if callable(step):
+            step(conn)
+        else:
+            for statement in _statements(step):
+                conn.execute(statement)
+
+
+def migrate(database):
+    """把数据库升级到 LATEST, 返回本次执行的迁移数"""
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT, isolation_level=None)
+    try:
+        version = current_version(conn)
+        if version >= LATEST:
+            if version > LATEST:
+                logger.warning('database schema version %d is newer than this code (%d)', version, LATEST)
+            return 0
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        applied = 0
+        for version, description, steps in MIGRATIONS:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # 其他进程可能在等待写锁期间已经完成了这个迁移
+                if current_version(conn) >= version:
+                    conn.execute('ROLLBACK')
+                    continue
+                _apply(conn, steps)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            logger.info('applied migration %d: %s', version, description)
+            applied += 1
+        return applied
+    finally:
+        conn.close()
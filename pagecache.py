@@ -0,0 +1,78 @@
+"""
+页面条件请求与渲染片段缓存
+
+目录页与课程详情页根据 versions.py 的版本号生成 ETag/Last-Modified, 客户端缓存仍然有效时直接返回 304, 不查询也不渲染.
+需要渲染时, 课程大纲、评价列表、课程卡片等片段按 (名称, 版本号) 缓存渲染好的 HTML: 内容变化后版本号递增, 旧键自然不再命中,
+无需主动失效. 每次请求只渲染登录状态、是否已选课/收藏等个人信息
+"""
+import hashlib
+import os
+
+from flask import make_response, render_template, request, session
+from markupsafe import Markup
+
+import authz
+import cache
+
+FRAGMENT_CACHE_TTL = 3600
+FRAGMENT_CACHE_ENTRIES = 2048
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+_fragments = cache.ReadThroughCache(cache.LRUCache(FRAGMENT_CACHE_ENTRIES, FRAGMENT_CACHE_TTL), cache.catalog.backend)
+
+
+def _template_digest():
+    # 模板改动 (重新部署) 后 ETag 与片段缓存键随之改变, 客户端与共享缓存中的旧页面不会被复用
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(TEMPLATE_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            with open(os.path.join(root, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATE_DIGEST = _template_digest()
+
+
+def cached(name, version, load):
+    """按版本号缓存任意可序列化的数据; load() 只在未命中时调用"""
+    return _fragments.get_or_load(f'{TEMPLATE_DIGEST}:{name}@{version}', load)
+
+
+def fragment(name, version, template, load):
+    """按版本号缓存渲染好的片段; load() 返回模板参数, 只在未命中时调用"""
+    return Markup(cached(name, version, lambda: render_template(template, **load())))
+
+
+def etag(*parts):
+    """页面 ETag: 版本号等页面参数 + 当前访问者 (导航栏中的用户名与角色)"""
+    principal = authz.current()
+    viewer = (session.get('user_id'), session.get('username'), tuple(sorted(principal.roles)) if principal else ())
+    return hashlib.sha1(repr((TEMPLATE_DIGEST, viewer) + parts).encode()).hexdigest()[:24]
+
+
+def _is_fresh(tag, last_modified):
+    # 同时带有两个条件时以 If-None-Match 为准 (RFC 7232)
+    if request.if_none_match:
+        return request.if_none_match.contains(tag)
+    return last_modified is not None and request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+
+def conditional(tag, last_modified, render):
+    """客户端缓存仍然有效时返回 304, 否则调用 render() 生成页面; 两种情况都带上验证器"""
+    if '_flashes' in session:
+        # 一次性提示消息不能被客户端缓存后重复显示
+        return render()
+    if _is_fresh(tag, last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(tag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    if 'user_id' in session:
+        response.cache_control.private = True
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,110 @@
+"""
+键集分页 (keyset pagination) - 以 (排序列, course_id) 作为游标, 翻页代价与页码无关
+"""
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 12
+MAX_PAGE_SIZE = 60
+# 近似总数: 最多数到这里为止, 超过时显示为 "1000+"
+APPROX_TOTAL_CAP = 1000
+# SQLite INTEGER 的取值范围, 超出时绑定参数会抛 OverflowError
+SQLITE_INT_MIN, SQLITE_INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+# 排序方式 -> (排序列, 方向); 平局一律按 course_id 同方向排序保证顺序稳定
+COURSE_SORTS = {
+    'newest': ('c.published_at', 'DESC'),
+    'popular': ('c.enrollment_count', 'DESC'),
+    'rating': ('c.rating_avg', 'DESC'),
+    'price_low': ('c.price', 'ASC'),
+    'price_high': ('c.price', 'DESC'),
+    'created': ('c.created_at', 'DESC'),
+    'relevance': ('course_fts.rank', 'ASC'),
+}
+
+
+class Page:
+    def __init__(self, items, next_cursor, total=None, total_capped=False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_capped = total_capped
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    if not value:
+        return default
+    return max(1, min(int(value), MAX_PAGE_SIZE))
+
+
+def encode_cursor(sort, value, key):
+    raw = json.dumps([sort, value, key], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _is_sql_int(value):
+    # bool 是 int 的子类, 单独排除
+    return type(value) is int and SQLITE_INT_MIN <= value <= SQLITE_INT_MAX
+
+
+def decode_cursor(token, sort):
+    """解析游标; 无效、被篡改 (值无法作为 SQL 参数绑定) 或与当前排序不匹配的游标视为第一页"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor_sort, value, key = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if cursor_sort != sort or not _is_sql_int(key):
+        return None
+    if not (value is None or isinstance(value, str) or _is_sql_int(value) or type(value) is float):
+        return None
+    return value, key
+
+
+def _keyset_segments(column, direction, key_column, cursor):
+    # SQLite 中 NULL 在 ASC 时排最前, DESC 时排最后; NULL 段单独查询, 非 NULL 段保持为索引范围扫描
+    if cursor is None:
+        return [('', [])]
+    value, key = cursor
+    op = '<' if direction == 'DESC' else '>'
+    if value is None:
+        segments = [(f' AND {column} IS NULL AND {key_column} {op} ?', [key])]
+        if direction == 'ASC':
+            segments.append((f' AND {column} IS NOT NULL', []))
+    else:
+        segments = [(f' AND {column} {op}= ? AND ({column} {op} ? OR {key_column} {op} ?)', [value, value, key])]
+        if direction == 'DESC':
+            segments.append((f' AND {column} IS NULL', []))
+    return segments
+
+
+def paginate(conn, columns, from_where, params, sort, cursor_token=None, limit=DEFAULT_PAGE_SIZE, key_column='c.course_id', sorts=COURSE_SORTS, with_total=True):
+    """执行 SELECT {columns} {from_where} 的一页; from_where 必须包含 WHERE 子句. 近似总数只在第一页统计, 之后的页 total 为 None"""
+    column, direction = sorts[sort]
+    cursor = decode_cursor(cursor_token, sort)
+    order = f' ORDER BY {column} {direction}, {key_column} {direction} LIMIT ?'
+    rows = []
+    for condition, extra in _keyset_segments(column, direction, key_column, cursor):
+        remaining = limit + 1 - len(rows)
+        if remaining <= 0:
+            break
+        sql = f'SELECT {columns}, {column} AS sort_value, {key_column} AS sort_key {from_where}{condition}{order}'
+        rows.extend(conn.execute(sql, list(params) + extra + [remaining]).fetchall())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(sort, rows[-1]['sort_value'], rows[-1]['sort_key'])
+    total = total_capped = None
+    if with_total and cursor is None:
+        total = conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 {from_where} LIMIT ?)', list(params) + [APPROX_TOTAL_CAP + 1]).fetchone()[0]
+        total_capped = total > APPROX_TOTAL_CAP
+        total = min(total, APPROX_TOTAL_CAP)
+    return Page(rows, next_cursor, total, total_capped)
@@ -0,0 +1,233 @@
+"""
+学习进度心跳 - 播放器上报的观看时长先在内存中合并, 再按时间间隔或数量阈值批量写入
+
+每次刷新是 db.writer 中的一个写操作: 批量 UPSERT learning_progress, 并根据本批新完成的课时数增量更新 enrollment 汇总.
+同时维护按选课记录存储的紧凑进度 (enrollment_progress): 按课程大纲中课时位置排列的完成位图与每课时进度数组,
+学习页面一次查找即可取出本课程的全部进度, 与用户学过多少其他课程无关
+"""
+import atexit
+import json
+import logging
+import os
+import sys
+import threading
+from array import array
+from datetime import datetime
+
+import cache
+import curriculum
+import db
+
+FLUSH_INTERVAL = 5.0
+FLUSH_SIZE = 500
+# 观看到课时时长的该比例即视为完成
+COMPLETION_THRESHOLD = 0.9
+MAX_EVENTS_PER_REQUEST = 50
+
+logger = logging.getLogger(__name__)
+_enrollments = cache.LRUCache(max_entries=4096, default_ttl=300)
+
+# layout 为写入时课程大纲的 Outline.layout, 不一致 (课时增删或调整顺序) 时按 learning_progress 重建
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS enrollment_progress (enrollment_id INTEGER PRIMARY KEY, layout INTEGER NOT NULL, completed BLOB NOT NULL, percents BLOB NOT NULL);
+    CREATE TRIGGER IF NOT EXISTS enrollment_progress_ad AFTER DELETE ON enrollment BEGIN
+        DELETE FROM enrollment_progress WHERE enrollment_id = old.enrollment_id;
+    END;
+'''
+
+
+def lesson_progress(watched_duration, video_duration):
+    """返回 (progress_percent, is_completed)"""
+    if not video_duration:
+        return (100.0, 1) if watched_duration > 0 else (0.0, 0)
+    ratio = min(watched_duration / video_duration, 1.0)
+    return round(ratio * 100, 2), int(ratio >= COMPLETION_THRESHOLD)
+
+
+class CourseProgress:
+    """一门课程的学习进度: 按课时位置的完成位图 + 每课时进度 (百分比 x 100, 小端 uint16)"""
+    __slots__ = ('completed', 'percents')
+
+    def __init__(self, completed, percents):
+        self.completed = completed
+        self.percents = percents
+
+    @classmethod
+    def empty(cls, lesson_count):
+        return cls(bytearray((lesson_count + 7) // 8), array('H', bytes(2 * lesson_count)))
+
+    @classmethod
+    def unpack(cls, completed, percents):
+        values = array('H', percents)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return cls(bytearray(completed), values)
+
+    def pack(self):
+        values = self.percents
+        if sys.byteorder == 'big':
+            values = array('H', values)
+            values.byteswap()
+        return bytes(self.completed), values.tobytes()
+
+    def is_completed(self, position):
+        return bool(self.completed[position >> 3] & (1 << (position & 7)))
+
+    def percent(self, position):
+        return self.percents[position] / 100
+
+    def update(self, position, percent, completed):
+        # 与 learning_progress 的 UPSERT 一致: 进度取较大值, 完成后不再回退
+        self.percents[position] = max(self.percents[position], min(round(percent * 100), 10000))
+        if completed:
+            self.completed[position >> 3] |= 1 << (position & 7)
+
+
+def _load_course_progress(conn, user_id, outline):
+    """由 learning_progress 构建: 按本课程的课时逐个主键查找, 代价与课程课时数成正比"""
+    course_progress = CourseProgress.empty(outline.lesson_count)
+    rows = conn.execute('''SELECT lp.lesson_id, lp.progress_percent, lp.is_completed FROM json_each(?) j
+        JOIN learning_progress lp ON lp.user_id = ? AND lp.lesson_id = j.value''', (json.dumps(list(outline.positions)), user_id))
+    for lesson_id, percent, completed in rows:
+        course_progress.update(outline.positions[lesson_id], percent or 0, completed)
+    return course_progress
+
+
+def _store_course_progress(conn, enrollment_id, layout, course_progress):
+    conn.execute('INSERT OR REPLACE INTO enrollment_progress (enrollment_id, layout, completed, percents) VALUES (?, ?, ?, ?)',
+                 (enrollment_id, layout, *course_progress.pack()))
+
+
+def rebuild_course_progress(conn, enrollment_id, user_id, outline):
+    """写操作: 按 learning_progress 重建一条选课记录的紧凑进度"""
+    _store_course_progress(conn, enrollment_id, outline.layout, _load_course_progress(conn, user_id, outline))
+
+
+def course_progress(conn, enrollment, outline):
+    """学习页面使用; enrollment 需带有 enrollment_progress 的 layout/completed/percents 列 (LEFT JOIN)"""
+    if enrollment['layout'] == outline.layout:
+        return CourseProgress.unpack(enrollment['completed'], enrollment['percents'])
+    # 尚未生成或课程大纲已变化: 本次直接读取 learning_progress, 由写线程重建后下次即可命中
+    db.writer.submit(rebuild_course_progress, enrollment['enrollment_id'], enrollment['user_id'], outline)
+    return _load_course_progress(conn, enrollment['user_id'], outline)
+
+
+class HeartbeatBuffer:
+    def __init__(self, interval=FLUSH_INTERVAL, size=FLUSH_SIZE):
+        self.interval = interval
+        self.size = size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, user_id, lesson_id, enrollment_id, watched_duration, video_duration):
+        """记录一次心跳; 同一用户同一课时只保留最大观看时长"""
+        percent, completed = lesson_progress(watched_duration, video_duration)
+        key = (user_id, lesson_id)
+        with self._lock:
+            previous = self._pending.get(key)
+            if previous is None or watched_duration > previous[1]:
+                self._pending[key] = (enrollment_id, watched_duration, percent, completed)
+            full = len(self._pending) >= self.size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='progress-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                # 刷新失败时数据已放回缓冲区, 下个周期重试
+                logger.exception('Failed to flush progress heartbeats')
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        with self._flush_lock:
+            try:
+                db.writer.call(write_batch, batch)
+            except Exception:
+                with self._lock:
+                    for key, entry in batch.items():
+                        current = self._pending.get(key)
+                        if current is None or entry[1] > current[1]:
+                            self._pending[key] = entry
+                raise
+        return len(batch)
+
+
+def enrollment_id(conn, user_id, course_id):
+    key = (user_id, course_id)
+    found = _enrollments.get(key)
+    if found is cache.MISSING:
+        row = conn.execute('SELECT enrollment_id FROM enrollment WHERE user_id = ? AND course_id = ?', key).fetchone()
+        if row is None:
+            return None
+        found = row['enrollment_id']
+        _enrollments.set(key, found)
+    return found
+
+
+def write_batch(conn, batch):
+    """写操作; batch: {(user_id, lesson_id): (enrollment_id, watched_duration, progress_percent, is_completed)}"""
+    keys = json.dumps(list(batch))
+    already_completed = {(row[0], row[1]) for row in conn.execute('''SELECT lp.user_id, lp.lesson_id FROM json_each(?) j
+        JOIN learning_progress lp ON lp.user_id = json_extract(j.value, '$[0]') AND lp.lesson_id = json_extract(j.value, '$[1]')
+        WHERE lp.is_completed = 1''', (keys,))}
+    conn.executemany('''INSERT INTO learning_progress (user_id, lesson_id, watched_duration, progress_percent, is_completed) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, lesson_id) DO UPDATE SET watched_duration = MAX(watched_duration, excluded.watched_duration),
+        progress_percent = MAX(progress_percent, excluded.progress_percent), is_completed = MAX(is_completed, excluded.is_completed)''',
+                     [(user_id, lesson_id, watched, percent, completed) for (user_id, lesson_id), (_, watched, percent, completed) in batch.items()])
+    # 只统计本批从未完成变为完成的课时, 不重新聚合 learning_progress
+    newly_completed = {}
+    for key, (enrollment, _, _, completed) in batch.items():
+        newly_completed.setdefault(enrollment, 0)
+        if completed and key not in already_completed:
+            newly_completed[enrollment] += 1
+    now = datetime.now()
+    _update_course_progress(conn, batch)
+    conn.executemany('''UPDATE enrollment SET completed_lessons = completed_lessons + ?,
+        progress_percent = CASE WHEN total_lessons > 0 THEN MIN(100.0, ROUND(100.0 * (completed_lessons + ?) / total_lessons, 2)) ELSE progress_percent END,
+        status = CASE WHEN total_lessons > 0 AND completed_lessons + ? >= total_lessons THEN 'completed' ELSE status END,
+        last_accessed_at = ? WHERE enrollment_id = ?''',
+                     [(delta, delta, delta, now, enrollment) for enrollment, delta in newly_completed.items()])
+
+
+def _update_course_progress(conn, batch):
+    """把本批进度合并进 enrollment_progress; 记录缺失或大纲已变化的选课按 learning_progress 整条重建"""
+    lessons = {}
+    for (user_id, lesson_id), (enrollment, _, percent, completed) in batch.items():
+        lessons.setdefault(enrollment, []).append((lesson_id, percent, completed))
+    rows = conn.execute('''SELECT e.enrollment_id, e.user_id, e.course_id, p.layout, p.completed, p.percents FROM json_each(?) j
+        JOIN enrollment e ON e.enrollment_id = j.value LEFT JOIN enrollment_progress p ON p.enrollment_id = e.enrollment_id''', (json.dumps(list(lessons)),))
+    for enrollment, user_id, course_id, layout, completed, percents in rows.fetchall():
+        outline = curriculum.get_outline(conn, course_id)
+        updates = lessons[enrollment]
+        if layout != outline.layout or any(lesson_id not in outline.positions for lesson_id, _, _ in updates):
+            rebuild_course_progress(conn, enrollment, user_id, outline)
+            continue
+        course_progress = CourseProgress.unpack(completed, percents)
+        for lesson_id, percent, done in updates:
+            course_progress.update(outline.positions[lesson_id], percent, done)
+        _store_course_progress(conn, enrollment, layout, course_progress)
+
+
+heartbeats = HeartbeatBuffer()
+atexit.register(heartbeats.flush)
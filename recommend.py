@@ -0,0 +1,237 @@
+"""
+"学过这门课的同学还学了" - 离线批量计算的课程共现推荐
+
+每个用户是一个稀疏的课程向量 (选课 1.0, 收藏 0.5, 两者都有则相加), 课程 a 与 b 的共现权重为所有用户向量分量乘积之和,
+相似度取余弦 weight(a, b) / sqrt(norm_sq(a) * norm_sq(b)). 共现矩阵按行存入 course_pair, 每门课程的前 K 个相似课程以
+JSON 数组存入 course_similar 的一行, 课程详情页一次主键查找即可取出.
+
+全量构建按 user_id 顺序流式读取选课与收藏 (走唯一索引, 不排序), 按课程号分片累加, 内存只与单个分片的非零元素数有关;
+增量刷新只处理水位线之后新增的选课/收藏, 把共现增量累加进 course_pair; 用户的课程数因新事件超过 MAX_BASKET 时扣除其此前的贡献.
+取消收藏等删除操作要等下一次全量构建才会反映.
+"""
+import heapq
+import itertools
+import json
+import logging
+import math
+from collections import Counter, defaultdict
+from datetime import datetime
+
+TOP_K = 10
+ENROLLMENT_WEIGHT = 1.0
+FAVORITE_WEIGHT = 0.5
+# 课程数超过该值的用户 (批量开通账号、爬虫) 对相似度没有意义, 且会产生平方级的课程对
+MAX_BASKET = 200
+# 每个分片在内存中累加的课程对上限; 据此自动决定分片数
+MAX_PAIRS_PER_SHARD = 5000000
+CHUNK_SIZE = 10000
+
+logger = logging.getLogger(__name__)
+
+# 全量构建先写入同结构的 <表名>_build, 完成后在一个事务中替换正式表并更新水位线
+_TABLES = {
+    'course_pair': '''CREATE TABLE IF NOT EXISTS {name} (course_id INTEGER NOT NULL, other_id INTEGER NOT NULL, weight REAL NOT NULL,
+        PRIMARY KEY (course_id, other_id)) WITHOUT ROWID''',
+    'course_norm': 'CREATE TABLE IF NOT EXISTS {name} (course_id INTEGER PRIMARY KEY, norm_sq REAL NOT NULL)',
+    'course_similar': 'CREATE TABLE IF NOT EXISTS {name} (course_id INTEGER PRIMARY KEY, recommended TEXT NOT NULL, refreshed_at DATETIME)',
+}
+
+SCHEMA = ''.join(f'''
+    {ddl.format(name=name)};''' for name, ddl in _TABLES.items()) + '''
+    CREATE TABLE IF NOT EXISTS recommendation_state (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+'''
+
+
+def similar_courses(conn, course_id, limit=4):
+    """课程详情页使用: 一次查找取出已发布的相似课程"""
+    return conn.execute('''SELECT c.course_id, c.title, c.cover_image, c.price, c.rating_avg, c.enrollment_count
+        FROM course_similar s JOIN json_each(s.recommended) j JOIN course c ON c.course_id = j.value
+        WHERE s.course_id = ? AND c.status = 'published' ORDER BY j.key LIMIT ?''', (course_id, limit)).fetchall()
+
+
+def _events(conn, watermarks):
+    """按 user_id 有序的 (user_id, course_id, weight) 流, 合并水位线以内的选课与收藏"""
+    enrollments = conn.execute(f'SELECT user_id, course_id, {ENROLLMENT_WEIGHT} FROM enrollment WHERE enrollment_id <= ? ORDER BY user_id, course_id', (watermarks[0],))
+    favorites = conn.execute(f'SELECT user_id, course_id, {FAVORITE_WEIGHT} FROM favorite WHERE favorite_id <= ? ORDER BY user_id, course_id', (watermarks[1],))
+    return heapq.merge(_stream(enrollments), _stream(favorites), key=lambda row: row[0])
+
+
+def _stream(cursor):
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def _baskets(conn, watermarks):
+    for user_id, rows in itertools.groupby(_events(conn, watermarks), key=lambda row: row[0]):
+        basket = Counter()
+        for _, course_id, weight in rows:
+            basket[course_id] += weight
+        if len(basket) <= MAX_BASKET:
+            yield basket
+
+
+def _top_k(course_id, row, norms, k):
+    norm = norms.get(course_id)
+    if not norm:
+        return []
+    scored = ((weight / math.sqrt(norm * norms[other]), other) for other, weight in row.items() if norms.get(other))
+    return [other for _, other in heapq.nlargest(k, scored)]
+
+
+def _shard_count(conn):
+    # 每个用户最多贡献 n*(n-1) 个课程对 (收藏与选课重叠时偏大, 因此是上界)
+    estimate = conn.execute(f'''SELECT COALESCE(SUM(MIN(n, {MAX_BASKET}) * (MIN(n, {MAX_BASKET}) - 1)), 0) FROM (
+        SELECT COUNT(*) AS n FROM (SELECT user_id FROM enrollment UNION ALL SELECT user_id FROM favorite) GROUP BY user_id)''').fetchone()[0]
+    return max(1, math.ceil(estimate / MAX_PAIRS_PER_SHARD))
+
+
+def _current_watermarks(conn):
+    return conn.execute('SELECT (SELECT COALESCE(MAX(enrollment_id), 0) FROM enrollment), (SELECT COALESCE(MAX(favorite_id), 0) FROM favorite)').fetchone()
+
+
+def _set_watermarks(conn, enrollment_id, favorite_id):
+    conn.executemany('INSERT OR REPLACE INTO recommendation_state (name, value) VALUES (?, ?)',
+                     [('enrollment_id', enrollment_id), ('favorite_id', favorite_id)])
+
+
+def _store_top_k(conn, recommended, now, table='course_similar'):
+    conn.executemany(f'INSERT OR REPLACE INTO {table} (course_id, recommended, refreshed_at) VALUES (?, ?, ?)',
+                     [(course_id, json.dumps(ids), now) for course_id, ids in recommended])
+
+
+def build(conn, top_k=TOP_K, shards=None):
+    """全量重建; 返回 (课程对数, 有推荐的课程数). 构建期间课程页继续使用旧结果, 中途失败不影响正式表与水位线"""
+    conn.isolation_level = None
+    watermarks = _current_watermarks(conn)
+    shards = shards or _shard_count(conn)
+    now = datetime.now()
+    norms = Counter()
+    for basket in _baskets(conn, watermarks):
+        for course_id, weight in basket.items():
+            norms[course_id] += weight * weight
+    # 上次中断的构建可能留下了 _build 表
+    for name, ddl in _TABLES.items():
+        conn.execute(f'DROP TABLE IF EXISTS {name}_build')
+        conn.execute(ddl.format(name=f'{name}_build'))
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany('INSERT INTO course_norm_build (course_id, norm_sq) VALUES (?, ?)', norms.items())
+    conn.execute('COMMIT')
+    total_pairs = total_courses = 0
+    for shard in range(shards):
+        rows = defaultdict(Counter)
+        for basket in _baskets(conn, watermarks):
+            items = list(basket.items())
+            for a, wa in items:
+                if a % shards != shard:
+                    continue
+                row = rows[a]
+                for b, wb in items:
+                    if b != a:
+                        row[b] += wa * wb
+        conn.execute('BEGIN IMMEDIATE')
+        for chunk in _chunked(((a, b, w) for a, row in rows.items() for b, w in row.items())):
+            conn.executemany('INSERT INTO course_pair_build (course_id, other_id, weight) VALUES (?, ?, ?)', chunk)
+            total_pairs += len(chunk)
+        _store_top_k(conn, [(a, _top_k(a, row, norms, top_k)) for a, row in rows.items()], now, 'course_similar_build')
+        conn.execute('COMMIT')
+        total_courses += len(rows)
+        logger.info('recommendation shard %d/%d: %d courses', shard + 1, shards, len(rows))
+    # 替换与水位线在同一事务中: 期间完成的增量刷新被整体覆盖, 其事件在水位线之后, 下次刷新会重新计入
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for name in _TABLES:
+            conn.execute(f'DROP TABLE {name}')
+            conn.execute(f'ALTER TABLE {name}_build RENAME TO {name}')
+        _set_watermarks(conn, *watermarks)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return total_pairs, total_courses
+
+
+def _deltas(conn, previous, watermarks):
+    """水位线 previous 到 watermarks 之间新增事件带来的共现增量与范数增量"""
+    users = [row[0] for row in conn.execute('SELECT user_id FROM enrollment WHERE enrollment_id > ? UNION SELECT user_id FROM favorite WHERE favorite_id > ?', previous)]
+    pair_delta, norm_delta = Counter(), Counter()
+    for user_id in users:
+        vector, new_events = Counter(), []
+        for event_id, course_id, weight in conn.execute(f'''SELECT enrollment_id, course_id, {ENROLLMENT_WEIGHT} FROM enrollment WHERE user_id = ? AND enrollment_id <= ?
+                UNION ALL SELECT -favorite_id, course_id, {FAVORITE_WEIGHT} FROM favorite WHERE user_id = ? AND favorite_id <= ?''',
+                                                        (user_id, watermarks[0], user_id, watermarks[1])):
+            if (event_id > previous[0]) if event_id > 0 else (-event_id > previous[1]):
+                new_events.append((course_id, weight))
+            else:
+                vector[course_id] += weight
+        if len(vector) > MAX_BASKET:
+            continue
+        if len(set(vector) | {course_id for course_id, _ in new_events}) > MAX_BASKET:
+            # 课程数刚超过上限: 全量构建会整体排除该用户, 这里扣除其此前计入的全部共现与范数
+            for a, wa in vector.items():
+                norm_delta[a] -= wa * wa
+                for b, wb in vector.items():
+                    if b != a:
+                        pair_delta[a, b] -= wa * wb
+            continue
+        # 用户向量是各事件之和, 共现对向量是双线性的: 逐个加入新事件, 增量 = 新分量 x 该用户当前向量
+        for course_id, weight in new_events:
+            for other, value in vector.items():
+                if other != course_id:
+                    pair_delta[course_id, other] += weight * value
+                    pair_delta[other, course_id] += weight * value
+            current = vector[course_id]
+            norm_delta[course_id] += (current + weight) ** 2 - current ** 2
+            vector[course_id] = current + weight
+    return pair_delta, norm_delta
+
+
+def refresh(conn, top_k=TOP_K):
+    """增量刷新: 只把水位线之后新增的选课/收藏计入共现矩阵, 并重算受影响课程的前 K 个; 返回受影响的课程数"""
+    conn.isolation_level = None
+    state = dict(conn.execute('SELECT name, value FROM recommendation_state').fetchall())
+    if not state:
+        return build(conn, top_k)[1]
+    previous = (state['enrollment_id'], state['favorite_id'])
+    watermarks = tuple(_current_watermarks(conn))
+    # 增量在写锁之外计算; 水位线以内的行不再变化, 写入前确认期间没有其他刷新推进过水位线
+    pair_delta, norm_delta = _deltas(conn, previous, watermarks)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if dict(conn.execute('SELECT name, value FROM recommendation_state').fetchall()) != state:
+            conn.execute('ROLLBACK')
+            return 0
+        conn.executemany('''INSERT INTO course_pair (course_id, other_id, weight) VALUES (?, ?, ?)
+            ON CONFLICT (course_id, other_id) DO UPDATE SET weight = weight + excluded.weight''', [(a, b, w) for (a, b), w in pair_delta.items()])
+        conn.executemany('''INSERT INTO course_norm (course_id, norm_sq) VALUES (?, ?)
+            ON CONFLICT (course_id) DO UPDATE SET norm_sq = norm_sq + excluded.norm_sq''', norm_delta.items())
+        # 扣除后归零的共现对与范数删除, 与全量构建的结果一致 (阈值容忍浮点累加误差)
+        conn.execute('DELETE FROM course_pair WHERE course_id IN (SELECT value FROM json_each(?)) AND weight < 1e-9', (json.dumps(list({a for a, _ in pair_delta})),))
+        conn.execute('DELETE FROM course_norm WHERE course_id IN (SELECT value FROM json_each(?)) AND norm_sq < 1e-9', (json.dumps(list(norm_delta)),))
+        # 余弦相似度的分母含对方课程的范数, 范数变化的课程的所有共现课程都要重算 (course_pair 是对称的, 按主键即可取出)
+        touched = {a for a, _ in pair_delta} | set(norm_delta) | {row[0] for row in conn.execute(
+            'SELECT DISTINCT p.other_id FROM json_each(?) j JOIN course_pair p ON p.course_id = j.value', (json.dumps(list(norm_delta)),))}
+        recommended = []
+        for course_id in touched:
+            row = dict(conn.execute('SELECT other_id, weight FROM course_pair WHERE course_id = ?', (course_id,)).fetchall())
+            norms = dict(conn.execute('SELECT course_id, norm_sq FROM course_norm WHERE course_id IN (SELECT value FROM json_each(?))',
+                                      (json.dumps([course_id, *row]),)).fetchall())
+            recommended.append((course_id, _top_k(course_id, row, norms, top_k)))
+        _store_top_k(conn, recommended, datetime.now())
+        _set_watermarks(conn, *watermarks)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(touched)
+
+
+def _chunked(rows, size=CHUNK_SIZE):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,112 @@
+"""
+讲师/管理员报表导出 - 选课、学习进度、收入明细, 以 CSV 或 JSONL (NDJSON) 流式输出
+
+响应体是一个生成器: 从只读连接的游标每次取 FETCH_SIZE 行, 编码 (客户端支持时再 gzip 压缩) 后立即交给服务器发送,
+内存占用与报表行数无关. 查询以课程为外层循环按课程分组输出, 不加 ORDER BY, 否则要等全部结果排好序才能发出第一行.
+连接在生成器第一次被迭代时才从连接池取出, 在 finally 中关闭游标并归还; 客户端中途断开时服务器关闭响应,
+生成器收到 GeneratorExit, 同样会走到 finally. 每个进程同时进行的导出数受 MAX_CONCURRENT_EXPORTS 限制,
+大导出不会占满工作线程与连接池; 导出在 WAL 快照上读取, 不阻塞写操作
+"""
+import csv
+import io
+import json
+import threading
+import zlib
+from datetime import date
+
+from flask import Response
+
+import db
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+FETCH_SIZE = 1000
+GZIP_LEVEL = 6
+MAX_CONCURRENT_EXPORTS = 2
+RETRY_AFTER = 30
+
+# {where} 为权限范围 (讲师只能导出自己的课程) 与课程筛选条件
+REPORTS = {
+    'enrollments': '''SELECT e.enrollment_id, c.course_id, c.title AS course_title, e.user_id, u.username, e.status, e.progress_percent, e.completed_lessons, e.total_lessons, e.enrolled_at, e.last_accessed_at, e.order_id
+        FROM course c JOIN enrollment e ON e.course_id = c.course_id JOIN user u ON u.user_id = e.user_id WHERE {where}''',
+    'progress': '''SELECT lp.user_id, u.username, c.course_id, c.title AS course_title, l.lesson_id, l.title AS lesson_title, lp.watched_duration, lp.progress_percent, lp.is_completed
+        FROM course c JOIN chapter ch ON ch.course_id = c.course_id JOIN lesson l ON l.chapter_id = ch.chapter_id JOIN learning_progress lp ON lp.lesson_id = l.lesson_id
+        JOIN user u ON u.user_id = lp.user_id WHERE {where}''',
+    'revenue': '''SELECT o.order_id, o.order_no, o.paid_at, o.payment_method, o.user_id, c.course_id, c.title AS course_title, oi.price
+        FROM course c JOIN order_item oi ON oi.course_id = c.course_id JOIN "order" o ON o.order_id = oi.order_id WHERE o.payment_status = 'paid' AND {where}''',
+}
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_EXPORTS)
+
+
+def _csv(columns, rows, header):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if header:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return out.getvalue().encode('utf-8')
+
+
+def _jsonl(columns, rows, header):
+    return ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n' for row in rows).encode('utf-8')
+
+
+_ENCODERS = {'csv': _csv, 'jsonl': _jsonl}
+
+
+def _stream(sql, params, fmt, compress):
+    encode = _ENCODERS[fmt]
+    # wbits=31: 带 gzip 头尾的 deflate 流
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    conn = db.pool.acquire()
+    cursor = None
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [d[0] for d in cursor.description]
+        header = True
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            data = encode(columns, rows, header)
+            header = False
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+            if not rows:
+                break
+        if compressor:
+            yield compressor.flush()
+    finally:
+        if cursor is not None:
+            cursor.close()
+        db.pool.release(conn)
+
+
+def export(name, fmt, instructor_id=None, course_id=None, compress=False):
+    """流式导出一个报表; instructor_id 为 None 表示管理员 (全部课程). 导出数已满时返回 503"""
+    conditions, params = [], []
+    if instructor_id is not None:
+        conditions.append('c.instructor_id = ?')
+        params.append(instructor_id)
+    if course_id is not None:
+        conditions.append('c.course_id = ?')
+        params.append(course_id)
+    if not _slots.acquire(blocking=False):
+        return Response('Too many exports in progress, please retry later\n', 503, {'Retry-After': str(RETRY_AFTER)}, mimetype='text/plain')
+    try:
+        sql = REPORTS[name].format(where=' AND '.join(conditions) or '1')
+        response = Response(_stream(sql, params, fmt, compress), mimetype=FORMATS[fmt])
+    except BaseException:
+        _slots.release()
+        raise
+    # 无论生成器是否被迭代过, 服务器关闭响应时都会调用, 在这里归还名额
+    response.call_on_close(_slots.release)
+    filename = f"{name}{'' if course_id is None else f'-course{course_id}'}-{date.today():%Y%m%d}.{fmt}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['Cache-Control'] = 'no-store'
+    # 让 nginx 等反向代理边收边发, 不缓冲整个响应
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.vary.add('Accept-Encoding')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
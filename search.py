@@ -0,0 +1,43 @@
+"""
+课程全文检索 - 基于 SQLite FTS5 (对应 MySQL 中的 FULLTEXT INDEX idx_title_desc)
+
+course_fts 是 course 表的外部内容索引, 由触发器增量同步, 结果按 BM25 排序
+"""
+import re
+
+# 标题权重最高, 其次副标题, 最后是描述
+RANK = 'bm25(10.0, 5.0, 1.0)'
+
+SCHEMA = f'''
+    CREATE VIRTUAL TABLE IF NOT EXISTS course_fts USING fts5(title, subtitle, description, content='course', content_rowid='course_id', tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+    CREATE TRIGGER IF NOT EXISTS course_fts_ai AFTER INSERT ON course BEGIN
+        INSERT INTO course_fts (rowid, title, subtitle, description) VALUES (new.course_id, new.title, new.subtitle, new.description);
+    END;
+    CREATE TRIGGER IF NOT EXISTS course_fts_ad AFTER DELETE ON course BEGIN
+        INSERT INTO course_fts (course_fts, rowid, title, subtitle, description) VALUES ('delete', old.course_id, old.title, old.subtitle, old.description);
+    END;
+    CREATE TRIGGER IF NOT EXISTS course_fts_au AFTER UPDATE OF title, subtitle, description ON course BEGIN
+        INSERT INTO course_fts (course_fts, rowid, title, subtitle, description) VALUES ('delete', old.course_id, old.title, old.subtitle, old.description);
+        INSERT INTO course_fts (rowid, title, subtitle, description) VALUES (new.course_id, new.title, new.subtitle, new.description);
+    END;
+    INSERT INTO course_fts (course_fts, rank) VALUES ('rank', '{RANK}');
+'''
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def match_expression(keyword):
+    """把用户输入转成安全的 FTS5 查询: 每个词都加引号并做前缀匹配, 词之间为 AND"""
+    terms = _TOKEN.findall(keyword or '')
+    return ' '.join('"%s"*' % term for term in terms)
+
+
+def is_indexed(conn):
+    indexed = conn.execute('SELECT COUNT(*) FROM course_fts_docsize').fetchone()[0]
+    return indexed == conn.execute('SELECT COUNT(*) FROM course').fetchone()[0]
+
+
+def rebuild(conn):
+    """由 course 表重建全文索引; 在调用方的事务中执行, 不自行提交"""
+    conn.execute("INSERT INTO course_fts (course_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO course_fts (course_fts) VALUES ('optimize')")
@@ -6,4 +6,19 @@ document.addEventListener('DOMContentLoaded', function() {
             new bootstrap.Alert(alert).close();
         });
     }, 5000);
+
+    // 学习进度心跳: 每隔一段时间上报当前课时的观看时长
+    var player = document.querySelector('[data-heartbeat-url]');
+    if (player) {
+        var watched = 0, started = Date.now();
+        var payload = function() {
+            return JSON.stringify({course_id: parseInt(player.dataset.courseId), lesson_id: parseInt(player.dataset.lessonId), watched_duration: watched + Math.floor((Date.now() - started) / 1000)});
+        };
+        setInterval(function() {
+            fetch(player.dataset.heartbeatUrl, {method: 'POST', headers: {'Content-Type': 'application/json'}, body: payload()});
+        }, 15000);
+        window.addEventListener('pagehide', function() {
+            navigator.sendBeacon(player.dataset.heartbeatUrl, new Blob([payload()], {type: 'application/json'}));
+        });
+    }
 });
@@ -0,0 +1,81 @@
+"""
+分类树 - category_closure 闭包表 (祖先, 后代, 深度) 与 category_stats 子树课程数
+
+"某分类及其所有子孙分类下的课程" 在任意层级都是一次 category_closure 索引查找;
+两张表都由触发器随 category / course 的增删改增量维护, rebuild() 用于初始化和修复.
+删除分类时其子分类的 parent_id 仍指向已删除的分类, 与 rebuild() 一致, 子分类各自成为独立的根: 原祖先与整棵子树之间的闭包行全部删除
+"""
+
+
+def _adjust_ancestors(category, delta):
+    # category 的所有祖先 (含自身) 的子树已发布课程数加 delta
+    return f'''UPDATE category_stats SET course_count = course_count + ({delta})
+        WHERE category_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = {category});'''
+
+
+_SUBTREE_COUNT = '''SELECT COUNT(*) FROM category_closure cc JOIN course c ON c.category_id = cc.descendant_id AND c.status = 'published'
+            WHERE cc.ancestor_id = {ancestor}'''
+
+SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS category_closure (ancestor_id INTEGER NOT NULL, descendant_id INTEGER NOT NULL, depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_category_closure_descendant ON category_closure (descendant_id, ancestor_id);
+    CREATE TABLE IF NOT EXISTS category_stats (category_id INTEGER PRIMARY KEY, course_count INTEGER NOT NULL DEFAULT 0);
+    CREATE TRIGGER IF NOT EXISTS category_closure_ai AFTER INSERT ON category BEGIN
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth) SELECT ancestor_id, new.category_id, depth + 1 FROM category_closure WHERE descendant_id = new.parent_id;
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth) VALUES (new.category_id, new.category_id, 0);
+        INSERT OR IGNORE INTO category_stats (category_id) VALUES (new.category_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_closure_bu BEFORE UPDATE OF parent_id ON category
+        WHEN EXISTS (SELECT 1 FROM category_closure WHERE ancestor_id = new.category_id AND descendant_id = new.parent_id) BEGIN
+        SELECT RAISE(ABORT, 'category cannot be moved under its own subtree');
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_closure_au AFTER UPDATE OF parent_id ON category WHEN old.parent_id IS NOT new.parent_id BEGIN
+        UPDATE category_stats SET course_count = course_count - (SELECT course_count FROM category_stats WHERE category_id = new.category_id)
+            WHERE category_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = new.category_id AND ancestor_id != new.category_id);
+        DELETE FROM category_closure WHERE descendant_id IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = new.category_id)
+            AND ancestor_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = new.category_id AND ancestor_id != new.category_id);
+        INSERT INTO category_closure (ancestor_id, descendant_id, depth) SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+            FROM category_closure a JOIN category_closure d ON d.ancestor_id = new.category_id WHERE a.descendant_id = new.parent_id;
+        UPDATE category_stats SET course_count = course_count + (SELECT course_count FROM category_stats WHERE category_id = new.category_id)
+            WHERE category_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = new.category_id AND ancestor_id != new.category_id);
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_closure_ad AFTER DELETE ON category BEGIN
+        UPDATE category_stats SET course_count = course_count - (SELECT course_count FROM category_stats WHERE category_id = old.category_id)
+            WHERE category_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = old.category_id AND ancestor_id != old.category_id);
+        DELETE FROM category_closure WHERE descendant_id IN (SELECT descendant_id FROM category_closure WHERE ancestor_id = old.category_id)
+            AND ancestor_id IN (SELECT ancestor_id FROM category_closure WHERE descendant_id = old.category_id);
+        DELETE FROM category_stats WHERE category_id = old.category_id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_count_ai AFTER INSERT ON course WHEN new.status = 'published' BEGIN
+        {_adjust_ancestors('new.category_id', 1)}
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_count_ad AFTER DELETE ON course WHEN old.status = 'published' BEGIN
+        {_adjust_ancestors('old.category_id', -1)}
+    END;
+    CREATE TRIGGER IF NOT EXISTS category_count_au AFTER UPDATE OF category_id, status ON course
+        WHEN (old.status = 'published' OR new.status = 'published') AND (old.category_id IS NOT new.category_id OR old.status IS NOT new.status) BEGIN
+        {_adjust_ancestors('old.category_id', "-(old.status = 'published')")}
+        {_adjust_ancestors('new.category_id', "(new.status = 'published')")}
+    END;
+'''
+
+# 子树过滤: AND c.category_id IN ({SUBTREE})
+SUBTREE = 'SELECT descendant_id FROM category_closure WHERE ancestor_id = ?'
+
+
+def is_built(conn):
+    return conn.execute('SELECT (SELECT COUNT(*) FROM category_stats) = (SELECT COUNT(*) FROM category)').fetchone()[0] == 1
+
+
+def rebuild(conn):
+    """由 category.parent_id 与已发布课程重建闭包表和子树课程数; 在调用方的事务中执行, 不自行提交"""
+    conn.execute('DELETE FROM category_closure')
+    conn.execute('''INSERT INTO category_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT category_id, category_id, 0 FROM category
+            UNION ALL SELECT t.ancestor_id, c.category_id, t.depth + 1 FROM tree t JOIN category c ON c.parent_id = t.descendant_id)
+        SELECT ancestor_id, descendant_id, MIN(depth) FROM tree GROUP BY ancestor_id, descendant_id''')
+    conn.execute('DELETE FROM category_stats')
+    conn.execute(f'''INSERT INTO category_stats (category_id, course_count)
+        SELECT cat.category_id, ({_SUBTREE_COUNT.format(ancestor='cat.category_id')}) FROM category cat''')
@@ -0,0 +1,335 @@
+"""
+批量导入/导出 - 以 CSV 或 JSONL 流式读写用户、分类、课程、章节、课时、选课与订单数据
+
+导入: 逐行读取 -> 按块 executemany -> 每 COMMIT_ROWS 行提交一次, 断点 (文件偏移与行数) 与数据在同一事务中写入,
+中断后加 --resume 从上次提交处继续; 内存占用只与块大小有关. 默认在导入期间删除目标表的二级索引与触发器,
+导入结束后重建索引, 并一次性重建全文索引、分类课程数、报名数等派生数据.
+导出: 直接遍历游标逐行写出, 不会把结果集整体读入内存.
+
+导入期间长事务会阻塞应用的写线程, 应在维护窗口执行.
+
+用法:
+    python transfer.py import courses partner_courses.csv [--resume] [--on-conflict ignore]
+    python transfer.py export enrollments enrollments.jsonl
+    python transfer.py export users - --format csv
+"""
+import argparse
+import codecs
+import csv
+import io
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+ENTITIES = {
+    'users': 'user',
+    'categories': 'category',
+    'courses': 'course',
+    'chapters': 'chapter',
+    'lessons': 'lesson',
+    'enrollments': 'enrollment',
+    'orders': 'order',
+    'order_items': 'order_item',
+}
+FORMATS = ('csv', 'jsonl')
+CHUNK_SIZE = 50000
+COMMIT_ROWS = 500000
+PROGRESS_INTERVAL = 5.0
+CONFLICT_CLAUSES = {'abort': 'INSERT', 'ignore': 'INSERT OR IGNORE', 'replace': 'INSERT OR REPLACE'}
+# 导入连接的页缓存 (KiB), 重建大表索引时排序需要
+IMPORT_CACHE_KIB = 262144
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS import_checkpoint (source TEXT NOT NULL, table_name TEXT NOT NULL, fingerprint TEXT NOT NULL,
+        byte_offset INTEGER NOT NULL, rows INTEGER NOT NULL, updated_at DATETIME, PRIMARY KEY (source, table_name));
+    CREATE TABLE IF NOT EXISTS import_deferred (name TEXT PRIMARY KEY, table_name TEXT NOT NULL, sql TEXT NOT NULL);
+'''
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    if path.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if path.endswith('.csv'):
+        return 'csv'
+    raise SystemExit(f'Cannot infer the format of {path}; pass --format')
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+# ---------- 导入 ----------
+
+class Source:
+    """逐行读取的文件; offset 始终是最后一条已产出记录之后的字节位置, 用作断点"""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        self.offset = 0
+        self._file = open(path, 'rb')
+        self.columns = self._read_header()
+
+    def _lines(self):
+        for line in iter(self._file.readline, b''):
+            self.offset += len(line)
+            yield line.decode('utf-8')
+
+    def _read_header(self):
+        # 跳过 Excel 等工具写入的 UTF-8 BOM
+        if self._file.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            self.offset = len(codecs.BOM_UTF8)
+        self._file.seek(self.offset)
+        if self.fmt == 'csv':
+            return next(csv.reader(self._lines()), None) or []
+        # JSONL 的列取自第一条记录, 读完后回到第一条记录之前
+        first = self._file.readline()
+        self._file.seek(self.offset)
+        return list(json.loads(first)) if first.strip() else []
+
+    def seek(self, offset):
+        if offset:
+            self._file.seek(offset)
+            self.offset = offset
+
+    def records(self):
+        """产出与 self.columns 对应的值列表; CSV 中的空字符串视为 NULL"""
+        if self.fmt == 'csv':
+            # csv.reader 只在当前记录需要时才取下一行 (引号内的换行也是如此), 因此 offset 与已产出记录一致
+            for values in csv.reader(self._lines()):
+                if values:
+                    yield [value if value != '' else None for value in values]
+        else:
+            for line in self._lines():
+                if line.strip():
+                    record = json.loads(line)
+                    yield [record.get(column) for column in self.columns]
+
+    def fingerprint(self):
+        stat = os.fstat(self._file.fileno())
+        return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+    def close(self):
+        self._file.close()
+
+
+def defer_ddl(conn, table):
+    """删除目标表的二级索引与触发器, 原始 DDL 记入 import_deferred (中断后下次运行会先恢复)"""
+    # 自动创建的唯一约束索引 (sql 为 NULL) 保留, 冲突处理依赖它们
+    objects = conn.execute('''SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL''', (table,)).fetchall()
+    conn.execute('BEGIN IMMEDIATE')
+    for kind, name, sql in objects:
+        conn.execute('INSERT INTO import_deferred (name, table_name, sql) VALUES (?, ?, ?)', (name, table, sql))
+        conn.execute(f'DROP {kind.upper()} "{name}"')
+    conn.execute('COMMIT')
+    return len(objects)
+
+
+def restore_ddl(conn, log):
+    """重建之前删除的索引与触发器; 返回涉及的表"""
+    deferred = conn.execute('SELECT name, table_name, sql FROM import_deferred').fetchall()
+    if not deferred:
+        return set()
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    for name, table, sql in deferred:
+        # init_db() 可能已经用 IF NOT EXISTS 重新创建过
+        if not conn.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (name,)).fetchone():
+            conn.execute(sql)
+    conn.execute('DELETE FROM import_deferred')
+    conn.execute('COMMIT')
+    log('rebuilt %d indexes/triggers in %.1fs' % (len(deferred), time.perf_counter() - started))
+    return {table for _, table, _ in deferred}
+
+
+def rebuild_derived(conn, tables, log):
+    """导入期间没有触发器维护的派生数据一次性重建"""
+    import aggregates
+    import search
+    import taxonomy
+    if not tables:
+        return
+    started = time.perf_counter()
+    conn.execute('BEGIN IMMEDIATE')
+    if 'user' in tables:
+        # 与注册流程一致: 每个用户都有 student 角色与资料行
+        conn.execute('''INSERT OR IGNORE INTO user_role (user_id, role_id) SELECT u.user_id, r.role_id FROM user u JOIN role r ON r.role_name = 'student'
+            WHERE NOT EXISTS (SELECT 1 FROM user_role ur WHERE ur.user_id = u.user_id)''')
+        conn.execute('INSERT OR IGNORE INTO user_profile (user_id) SELECT user_id FROM user')
+    # 导入期间目标表上的触发器被暂时删除, 角色与课程归属可能变化的用户统一通知各进程的权限缓存 (见 authz.py)
+    if tables & {'user', 'course'}:
+        source = 'SELECT user_id AS id FROM user' if 'user' in tables else 'SELECT DISTINCT instructor_id AS id FROM course'
+        conn.execute(f'''INSERT INTO acl_version (user_id, version) SELECT id, (SELECT COALESCE(MAX(version), 0) + 1 FROM acl_version) FROM ({source}) WHERE 1
+            ON CONFLICT (user_id) DO UPDATE SET version = excluded.version''')
+    if tables & {'course', 'chapter', 'lesson', 'enrollment'}:
+        # 所有页面版本号递增, 客户端与片段缓存中的旧内容全部失效
+        conn.execute("UPDATE content_version SET version = version + 1, modified_at = strftime('%Y-%m-%d %H:%M:%S', 'now')")
+        conn.execute("INSERT OR IGNORE INTO content_version (scope, version, modified_at) VALUES (0, 1, strftime('%Y-%m-%d %H:%M:%S', 'now'))")
+    if 'course' in tables:
+        search.rebuild(conn)
+    if tables & {'course', 'category'}:
+        taxonomy.rebuild(conn)
+    conn.execute('COMMIT')
+    if 'enrollment' in tables:
+        aggregates.reconcile(conn, repair=True)
+    log('rebuilt derived data in %.1fs' % (time.perf_counter() - started))
+
+
+def _chunked(records, size):
+    it = iter(records)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def import_file(conn, entity, path, fmt=None, resume=False, on_conflict='abort', defer=True, log=print):
+    table = ENTITIES[entity]
+    source = Source(path, detect_format(path, fmt))
+    key = (os.path.abspath(path), table)
+    try:
+        known = table_columns(conn, table)
+        unknown = [column for column in source.columns if column not in known]
+        if unknown:
+            log(f'ignoring columns not in {table}: {", ".join(unknown)}')
+        if not any(column in known for column in source.columns):
+            raise SystemExit(f'{path} has no columns of table {table}')
+        keep = [i for i, column in enumerate(source.columns) if column in known]
+        columns = [source.columns[i] for i in keep]
+        sql = f'{CONFLICT_CLAUSES[on_conflict]} INTO "{table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+
+        checkpoint = conn.execute('SELECT fingerprint, byte_offset, rows FROM import_checkpoint WHERE source = ? AND table_name = ?', key).fetchone()
+        imported = 0
+        if checkpoint and resume:
+            if checkpoint[0] != source.fingerprint():
+                raise SystemExit(f'{path} changed since the checkpoint was written; rerun without --resume to start over')
+            source.seek(checkpoint[1])
+            imported = checkpoint[2]
+            log(f'resuming {path} after {imported} rows')
+        elif checkpoint:
+            raise SystemExit(f'{path} has an unfinished import ({checkpoint[2]} rows); pass --resume to continue')
+
+        if defer:
+            log(f'deferred {defer_ddl(conn, table)} indexes/triggers on {table}')
+        started = last_report = time.perf_counter()
+        records = ([values[i] for i in keep] for values in source.records()) if len(keep) != len(source.columns) else source.records()
+        pending = 0
+        conn.execute('BEGIN IMMEDIATE')
+        for chunk in _chunked(records, CHUNK_SIZE):
+            conn.executemany(sql, chunk)
+            imported += len(chunk)
+            pending += len(chunk)
+            if pending >= COMMIT_ROWS:
+                _save_checkpoint(conn, key, source, imported)
+                conn.execute('COMMIT')
+                conn.execute('BEGIN IMMEDIATE')
+                pending = 0
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL:
+                log('%s: %d rows, %.0f rows/s' % (table, imported, imported / (now - started)))
+                last_report = now
+        conn.execute('DELETE FROM import_checkpoint WHERE source = ? AND table_name = ?', key)
+        conn.execute('COMMIT')
+        log('%s: imported %d rows in %.1fs' % (table, imported, time.perf_counter() - started))
+    except (Exception, KeyboardInterrupt):
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        if conn.execute('SELECT 1 FROM import_checkpoint WHERE source = ? AND table_name = ?', key).fetchone():
+            log('import interrupted; rerun with --resume to continue from the last checkpoint')
+        raise
+    finally:
+        source.close()
+        # 无论成功与否都恢复索引与触发器, 保证应用可以继续使用
+        rebuild_derived(conn, restore_ddl(conn, log), log)
+    return imported
+
+
+def _save_checkpoint(conn, key, source, rows):
+    conn.execute('''INSERT INTO import_checkpoint (source, table_name, fingerprint, byte_offset, rows, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, table_name) DO UPDATE SET byte_offset = excluded.byte_offset, rows = excluded.rows, updated_at = excluded.updated_at''',
+                 (*key, source.fingerprint(), source.offset, rows, datetime.now()))
+
+
+# ---------- 导出 ----------
+
+def export_table(conn, entity, out, fmt):
+    """按主键顺序流式导出; 返回行数"""
+    table = ENTITIES[entity]
+    columns = table_columns(conn, table)
+    cursor = conn.execute(f'SELECT {", ".join(columns)} FROM "{table}" ORDER BY rowid')
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in cursor:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in cursor:
+            out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            out.write('\n')
+            count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stream platform data in and out as CSV/JSONL')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_import = sub.add_parser('import', help='Load a CSV/JSONL file into a table')
+    p_import.add_argument('entity', choices=sorted(ENTITIES))
+    p_import.add_argument('path')
+    p_import.add_argument('--format', choices=FORMATS)
+    p_import.add_argument('--resume', action='store_true', help='Continue an interrupted import from its last checkpoint')
+    p_import.add_argument('--on-conflict', choices=sorted(CONFLICT_CLAUSES), default='abort')
+    p_import.add_argument('--no-defer', action='store_true', help='Keep indexes/triggers during the import (better for small files into large tables)')
+    p_export = sub.add_parser('export', help='Write a table as CSV/JSONL (- for stdout)')
+    p_export.add_argument('entity', choices=sorted(ENTITIES))
+    p_export.add_argument('path')
+    p_export.add_argument('--format', choices=FORMATS)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+    import db
+    app.init_db()
+    log = lambda message: print(message, file=sys.stderr)
+    if args.command == 'import':
+        # 与 bench/datagen.py 相同, 绕过 db.connect() 的 SQL 监控
+        conn = sqlite3.connect(db.DATABASE, timeout=db.BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA cache_size = -{IMPORT_CACHE_KIB}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.executescript(SCHEMA)
+        # 上次导入被强行终止 (kill -9) 时索引与触发器可能仍未恢复
+        rebuild_derived(conn, restore_ddl(conn, log), log)
+        import_file(conn, args.entity, args.path, args.format, args.resume, args.on_conflict, not args.no_defer, log)
+        conn.close()
+    else:
+        fmt = detect_format(args.path, args.format) if args.path != '-' else (args.format or 'jsonl')
+        conn = db.connect(readonly=True)
+        if args.path == '-':
+            out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+            try:
+                count = export_table(conn, args.entity, out, fmt)
+                out.flush()
+            except BrokenPipeError:
+                # 下游 (如 head) 提前退出
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                return 1
+        else:
+            with open(args.path, 'w', encoding='utf-8', newline='') as out:
+                count = export_table(conn, args.entity, out, fmt)
+        conn.close()
+        log(f'exported {count} rows')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+内容版本号 - 每门课程一个版本计数器, 外加一个目录级计数器, 由触发器在数据变化时递增
+
+课程版本: 课程本身、章节、课时、评价发生变化时递增 (选课通过 enrollment_count 的更新间接递增).
+目录版本: 课程增删以及课程卡片上展示的字段变化时递增. 报名人数变化很频繁, 不计入目录版本, 目录页改为按
+CATALOG_REFRESH 秒分桶, 报名人数与原来的首页缓存一样最多滞后一个周期.
+版本号用于 ETag/Last-Modified 条件请求以及渲染片段缓存的键 (见 pagecache.py)
+"""
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import cache
+
+CATALOG = 0
+CATALOG_REFRESH = cache.CATALOG_CACHE_TTL
+
+# tag 用于 ETag 与缓存键, last_modified 为 UTC 时间 (无记录时为 None)
+Version = namedtuple('Version', 'tag last_modified')
+
+_NOW = "strftime('%Y-%m-%d %H:%M:%S', 'now')"
+
+
+def _bump(scope, source='', where='1'):
+    return f'''INSERT INTO content_version (scope, version, modified_at) SELECT {scope}, 1, {_NOW}{source} WHERE {where}
+        ON CONFLICT (scope) DO UPDATE SET version = version + 1, modified_at = excluded.modified_at;'''
+
+
+def _bump_lesson_course(row):
+    return _bump('course_id', ' FROM chapter', f'chapter_id = {row}.chapter_id')
+
+
+# 课程卡片上展示的列 (不含 enrollment_count)
+_CARD_COLUMNS = 'title, subtitle, instructor_id, category_id, cover_image, price, original_price, level, status, is_featured, rating_avg, rating_count, created_at, published_at'
+
+SCHEMA = f'''
+    CREATE TABLE IF NOT EXISTS content_version (scope INTEGER PRIMARY KEY, version INTEGER NOT NULL, modified_at TEXT NOT NULL);
+    CREATE TRIGGER IF NOT EXISTS content_version_course_ai AFTER INSERT ON course BEGIN
+        {_bump('new.course_id')}
+        {_bump(CATALOG)}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_course_au AFTER UPDATE ON course BEGIN
+        {_bump('new.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_catalog_au AFTER UPDATE OF {_CARD_COLUMNS} ON course BEGIN
+        {_bump(CATALOG)}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_course_ad AFTER DELETE ON course BEGIN
+        {_bump('old.course_id')}
+        {_bump(CATALOG)}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_chapter_ai AFTER INSERT ON chapter BEGIN
+        {_bump('new.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_chapter_au AFTER UPDATE ON chapter BEGIN
+        {_bump('old.course_id')}
+        {_bump('new.course_id', where='new.course_id != old.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_chapter_ad AFTER DELETE ON chapter BEGIN
+        {_bump('old.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_lesson_ai AFTER INSERT ON lesson BEGIN
+        {_bump_lesson_course('new')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_lesson_au AFTER UPDATE ON lesson BEGIN
+        {_bump_lesson_course('old')}
+        {_bump('course_id', ' FROM chapter', 'chapter_id = new.chapter_id AND new.chapter_id != old.chapter_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_lesson_ad AFTER DELETE ON lesson BEGIN
+        {_bump_lesson_course('old')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_review_ai AFTER INSERT ON review BEGIN
+        {_bump('new.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_review_au AFTER UPDATE ON review BEGIN
+        {_bump('old.course_id')}
+        {_bump('new.course_id', where='new.course_id != old.course_id')}
+    END;
+    CREATE TRIGGER IF NOT EXISTS content_version_review_ad AFTER DELETE ON review BEGIN
+        {_bump('old.course_id')}
+    END;
+'''
+
+
+def _parse(modified_at):
+    return datetime.strptime(modified_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+
+
+def _catalog_version(row):
+    bucket = int(time.time() // CATALOG_REFRESH)
+    bucket_start = datetime.fromtimestamp(bucket * CATALOG_REFRESH, timezone.utc)
+    if row is None:
+        return Version(f'0.{bucket}', bucket_start)
+    return Version(f"{row['version']}.{bucket}", max(_parse(row['modified_at']), bucket_start))
+
+
+def catalog(conn):
+    """目录版本 (首页、课程列表)"""
+    return _catalog_version(conn.execute('SELECT version, modified_at FROM content_version WHERE scope = ?', (CATALOG,)).fetchone())
+
+
+def course(conn, course_id):
+    """一次查询取出 (课程版本, 目录版本); 课程详情页的相似课程卡片依赖目录版本"""
+    rows = {row['scope']: row for row in conn.execute('SELECT scope, version, modified_at FROM content_version WHERE scope IN (?, ?)', (CATALOG, course_id))}
+    row = rows.get(course_id)
+    course_version = Version(str(row['version']), _parse(row['modified_at'])) if row else Version('0', None)
+    return course_version, _catalog_version(rows.get(CATALOG))